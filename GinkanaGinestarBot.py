@@ -1,25 +1,433 @@
 from dotenv import load_dotenv
 import os
 load_dotenv()
+import asyncio
+import collections
+import contextvars
+import csv
 import datetime
+import functools
+import hashlib
+import io
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, TypeHandler, ContextTypes, filters
 import gspread
+from gspread.utils import numericise_all
 from zoneinfo import ZoneInfo
 from typing import Callable, Any, Dict, Tuple, Optional
 
 MADRID_TZ = ZoneInfo("Europe/Madrid")
-MOSTRAR_FI30 = True  # per defecte mostrem l'hora final del bloc 3
 
 # ----------------------------
 # Variables d'entorn
 # ----------------------------
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-if not TELEGRAM_TOKEN:
-    print("❌ Falta la variable d'entorn TELEGRAM_TOKEN")
-    exit(1)
 
 GINKANA_PUNTS_SHEET = os.getenv("GINKANA_PUNTS_SHEET", "punts_equips")
+# Diverses ginkanes en un sol procés: "nom=document,nom2=document2". Buit: una
+# sola ginkana amb GINKANA_PUNTS_SHEET. La primera és la dels xats sense triar.
+GINKANA_ESDEVENIMENTS = os.getenv("GINKANA_ESDEVENIMENTS", "")
+# On es recorda la ginkana de cada xat (triada amb /start <nom> o /ginkana <nom>)
+GINKANA_XATS = os.getenv("GINKANA_XATS", "xats_ginkanes.json")
+# Pressupost de cache per ginkana: missatges renderitzats i segons d'inactivitat
+# abans d'alliberar-ne la cache (es torna a llegir quan algú la fa servir)
+GINKANA_RENDERS_MAX = int(os.getenv("GINKANA_RENDERS_MAX", "200"))
+GINKANA_INACTIVA = float(os.getenv("GINKANA_INACTIVA", "3600"))
+# Magatzem de dades: "sheets" (Google Sheets) o "sqlite" (local, sense xarxa)
+GINKANA_BACKEND = os.getenv("GINKANA_BACKEND", "sheets")
+GINKANA_SQLITE = os.getenv("GINKANA_SQLITE", "ginkana.sqlite3")
+GINKANA_DIR_LLAVOR = os.getenv("GINKANA_DIR_LLAVOR", os.path.dirname(os.path.abspath(__file__)))
+# Amb sqlite, replicar també les escriptures a Google Sheets
+GINKANA_MIRALL_SHEETS = os.getenv("GINKANA_MIRALL_SHEETS", "0") == "1"
+# Nombre màxim de crides a Google Sheets que poden estar en vol alhora
+SHEETS_CONCURRENCY = int(os.getenv("SHEETS_CONCURRENCY", "4"))
+# Fils reservats per a les escriptures (no competeixen amb les lectures)
+SHEETS_CONCURRENCY_ESCRIPTURA = int(os.getenv("SHEETS_CONCURRENCY_ESCRIPTURA", "2"))
+# Quotes de l'API de Sheets per minut (0 = sense límit) i reintents per 429/5xx
+SHEETS_LECTURES_MINUT = int(os.getenv("SHEETS_LECTURES_MINUT", "60"))
+SHEETS_ESCRIPTURES_MINUT = int(os.getenv("SHEETS_ESCRIPTURES_MINUT", "60"))
+SHEETS_REINTENTS = int(os.getenv("SHEETS_REINTENTS", "5"))
+# Cua d'escriptura diferida de respostes (write-behind)
+SUBMISSIONS_WAL = os.getenv("SUBMISSIONS_WAL", "submissions.wal")
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2"))     # segons entre buidats
+FLUSH_BATCH = int(os.getenv("FLUSH_BATCH", "100"))           # files per append_rows
+# Mode webhook: si WEBHOOK_URL està definida el bot escolta al $PORT del dyno
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                      # p. ex. https://ginkana.herokuapp.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+PORT = int(os.getenv("PORT", "8443"))
+UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "16"))
+# Processar updates de diferents usuaris en paral·lel (també amb polling)
+UPDATES_CONCURRENTS = os.getenv("UPDATES_CONCURRENTS", "1") == "1"
+# Usuaris de Telegram (sense @) que poden fer servir les comandes d'administració
+ADMINS = {u.strip().lstrip("@").lower() for u in os.getenv("ADMINS", "").split(",") if u.strip()}
+# Port opcional on s'exposen les mètriques en format Prometheus
+METRIQUES_PORT = os.getenv("METRIQUES_PORT")
+# Snapshot periòdic de les dades per arrencar en calent
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "ginkana_snapshot.json")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))
+# Cada quants segons es rellegeix punts_equips sencer (la resta només la cua)
+RECORDS_RECONCILIACIO = float(os.getenv("RECORDS_RECONCILIACIO", "300"))
+# Respostes aproximades: desactivades per defecte (només coincidència exacta
+# després de normalitzar). L'organització les activa per tipus de prova amb la
+# distància d'edició màxima, p. ex. RESPOSTA_DISTANCIA="trivia:1"; la longitud
+# mínima de la resposta per aplicar-la és RESPOSTA_LONGITUD_APROXIMADA.
+RESPOSTA_DISTANCIA = os.getenv("RESPOSTA_DISTANCIA", "")
+RESPOSTA_LONGITUD_APROXIMADA = int(os.getenv("RESPOSTA_LONGITUD_APROXIMADA", "5"))
+# Difusió del missatge d'emergència
+DIFUSIO_LOG = os.getenv("DIFUSIO_LOG", "difusions.log")
+DIFUSIO_CONCURRENCIA = int(os.getenv("DIFUSIO_CONCURRENCIA", "8"))
+DIFUSIO_MISSATGES_SEGON = float(os.getenv("DIFUSIO_MISSATGES_SEGON", "25"))  # Telegram: ~30/s per bot
+DIFUSIO_REINTENTS = int(os.getenv("DIFUSIO_REINTENTS", "4"))
+# Classificació en directe (/seguir): subscriptors i ritme de les edicions
+SEGUIR_PATH = os.getenv("SEGUIR_PATH", "seguidors.json")
+SEGUIR_INTERVAL = float(os.getenv("SEGUIR_INTERVAL", "10"))          # segons entre passades
+SEGUIR_INTERVAL_XAT = float(os.getenv("SEGUIR_INTERVAL_XAT", "30"))  # mínim entre edicions d'un xat
+# Diari JSONL d'updates i canvis d'estat (buit = desactivat); replay_ginkana.py el reprodueix
+DIARI_PATH = os.getenv("DIARI_PATH", "diari_ginkana.jsonl")
+DIARI_MIDA_MAX = int(os.getenv("DIARI_MIDA_MAX", str(50 * 1024 * 1024)))   # bytes abans de rotar
+DIARI_FITXERS = int(os.getenv("DIARI_FITXERS", "20"))        # fitxers rotats que es conserven
+DIARI_INTERVAL = float(os.getenv("DIARI_INTERVAL", "1"))     # segons entre escriptures
+DIARI_BUFFER_MAX = int(os.getenv("DIARI_BUFFER_MAX", "50000"))  # entrades en memòria com a màxim
+
+# ----------------------------
+# Mètriques
+# ----------------------------
+# Latència per handler, crides a Sheets per fulla i mètode, encerts de la
+# cache, profunditat de les cues i errors. Es consulten amb /stats (admins)
+# i, si METRIQUES_PORT està definit, en format Prometheus per HTTP.
+_BUCKETS_SEGONS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class _Histograma:
+    def __init__(self):
+        self.buckets = [0] * len(_BUCKETS_SEGONS)
+        self.n = 0
+        self.suma = 0.0
+        self.errors = 0
+        self.recents = collections.deque(maxlen=500)   # per als percentils de /stats
+
+    def observar(self, segons: float, error: bool = False):
+        for i, limit in enumerate(_BUCKETS_SEGONS):
+            if segons <= limit:
+                self.buckets[i] += 1
+        self.n += 1
+        self.suma += segons
+        self.recents.append(segons)
+        if error:
+            self.errors += 1
+
+    def percentil(self, p: float) -> float:
+        if not self.recents:
+            return 0.0
+        ordenats = sorted(self.recents)
+        return ordenats[min(len(ordenats) - 1, int(len(ordenats) * p / 100))]
+
+class Metriques:
+    def __init__(self):
+        self._lock = threading.Lock()   # les crides a Sheets s'observen des dels fils de l'executor
+        self.handlers: Dict[str, _Histograma] = {}
+        self.sheets: Dict[Tuple[str, str], _Histograma] = {}
+        self.errors: Dict[str, int] = {}
+        self.cues: Dict[str, Callable[[], int]] = {}
+
+    def handler(self, nom: str, segons: float, error: bool = False):
+        with self._lock:
+            self.handlers.setdefault(nom, _Histograma()).observar(segons, error)
+
+    def crida_sheets(self, fulla: str, metode: str, segons: float, error: bool = False):
+        with self._lock:
+            self.sheets.setdefault((fulla, metode), _Histograma()).observar(segons, error)
+
+    def error(self, tipus: str):
+        with self._lock:
+            self.errors[tipus] = self.errors.get(tipus, 0) + 1
+
+    def cua(self, nom: str, profunditat: Callable[[], int]):
+        """Registra una funció que retorna la mida actual d'una cua."""
+        self.cues[nom] = profunditat
+
+    def profunditats(self) -> Dict[str, int]:
+        return {nom: f() for nom, f in self.cues.items()}
+
+    def resum(self) -> str:
+        """Text per a /stats."""
+        with self._lock:
+            handlers = sorted(self.handlers.items())
+            sheets = sorted(self.sheets.items())
+            errors = sorted(self.errors.items())
+        linies = ["📊 Estadístiques del bot\n\n⏱️ Handlers (p50/p95/p99 ms, n, errors):\n"]
+        for nom, h in handlers:
+            linies.append(f"{nom}: {h.percentil(50) * 1000:.0f}/{h.percentil(95) * 1000:.0f}/"
+                          f"{h.percentil(99) * 1000:.0f} ms, n={h.n}, errors={h.errors}\n")
+        linies.append("\n📄 Google Sheets (crides, mitjana ms, errors):\n")
+        for (fulla, metode), h in sheets:
+            linies.append(f"{fulla}.{metode}: {h.n}, {h.suma / h.n * 1000:.0f} ms, errors={h.errors}\n")
+        linies.append("\n🗃️ Cache (encerts / total):\n")
+        for nom, s in sorted(cache_stats().items()):
+            total = s["hits"] + s["stale"] + s["misses"]
+            ratio = (s["hits"] + s["stale"]) / total * 100 if total else 0
+            linies.append(f"{nom}: {ratio:.0f}% de {total} (refrescos={s['refrescos']}, errors={s['errors']})\n")
+        linies.append("\n📥 Cues:\n")
+        for nom, n in sorted(self.profunditats().items()):
+            linies.append(f"{nom}: {n}\n")
+        if errors:
+            linies.append("\n❗ Errors:\n")
+            for tipus, n in errors:
+                linies.append(f"{tipus}: {n}\n")
+        return "".join(linies)
+
+    def prometheus(self) -> str:
+        """Exposició en format de text de Prometheus."""
+        def histograma(nom, etiquetes, h):
+            sortida = []
+            for limit, n in zip(_BUCKETS_SEGONS, h.buckets):
+                sortida.append(f'{nom}_bucket{{{etiquetes},le="{limit}"}} {n}')
+            sortida.append(f'{nom}_bucket{{{etiquetes},le="+Inf"}} {h.n}')
+            sortida.append(f"{nom}_sum{{{etiquetes}}} {h.suma}")
+            sortida.append(f"{nom}_count{{{etiquetes}}} {h.n}")
+            return sortida
+
+        linies = ["# TYPE ginkana_handler_segons histogram"]
+        with self._lock:
+            for nom, h in sorted(self.handlers.items()):
+                linies += histograma("ginkana_handler_segons", f'handler="{nom}"', h)
+            linies.append("# TYPE ginkana_handler_errors_total counter")
+            for nom, h in sorted(self.handlers.items()):
+                linies.append(f'ginkana_handler_errors_total{{handler="{nom}"}} {h.errors}')
+            linies.append("# TYPE ginkana_sheets_segons histogram")
+            for (fulla, metode), h in sorted(self.sheets.items()):
+                linies += histograma("ginkana_sheets_segons", f'fulla="{fulla}",metode="{metode}"', h)
+            linies.append("# TYPE ginkana_sheets_errors_total counter")
+            for (fulla, metode), h in sorted(self.sheets.items()):
+                linies.append(f'ginkana_sheets_errors_total{{fulla="{fulla}",metode="{metode}"}} {h.errors}')
+            linies.append("# TYPE ginkana_errors_total counter")
+            for tipus, n in sorted(self.errors.items()):
+                linies.append(f'ginkana_errors_total{{tipus="{tipus}"}} {n}')
+        linies.append("# TYPE ginkana_cache_total counter")
+        for nom, s in sorted(cache_stats().items()):
+            for resultat, n in sorted(s.items()):
+                linies.append(f'ginkana_cache_total{{clau="{nom}",resultat="{resultat}"}} {n}')
+        linies.append("# TYPE ginkana_cua_profunditat gauge")
+        for nom, n in sorted(self.profunditats().items()):
+            linies.append(f'ginkana_cua_profunditat{{cua="{nom}"}} {n}')
+        return "\n".join(linies) + "\n"
+
+metriques = Metriques()
+
+def mesurat(nom: str, handler: Callable[..., Any]):
+    """Embolcalla un handler per registrar-ne la latència i els errors."""
+    @functools.wraps(handler)
+    async def embolcall(update, context):
+        inici = time.perf_counter()
+        error = False
+        try:
+            return await handler(update, context)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metriques.handler(nom, time.perf_counter() - inici, error)
+    return embolcall
+
+class FullaInstrumentada:
+    """Worksheet que compta i cronometra cada crida a l'API de Sheets."""
+
+    def __init__(self, worksheet, nom: str):
+        self._worksheet = worksheet
+        self._nom = nom
+
+    def __getattr__(self, atribut):
+        valor = getattr(self._worksheet, atribut)
+        if not callable(valor):
+            return valor
+
+        def crida(*args, **kwargs):
+            inici = time.perf_counter()
+            error = False
+            try:
+                return valor(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                metriques.crida_sheets(self._nom, atribut, time.perf_counter() - inici, error)
+        return crida
+
+async def _servir_metriques(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+        cos = metriques.prometheus().encode("utf-8")
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     b"Content-Length: " + str(len(cos)).encode() + b"\r\n"
+                     b"Connection: close\r\n\r\n" + cos)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+def es_admin(user) -> bool:
+    return bool(user) and (user.username or "").lower() in ADMINS
+
+# ----------------------------
+# Limitador de ritme
+# ----------------------------
+class TokenBucket:
+    """Limitador de ritme: `taxa` fitxes per segon amb ràfegues de fins a `capacitat`."""
+
+    def __init__(self, taxa: float, capacitat: Optional[float] = None):
+        self.taxa = taxa
+        self.capacitat = capacitat if capacitat is not None else max(taxa, 1)
+        self._fitxes = self.capacitat
+        self._darrer = time.monotonic()
+        self._pausa_fins = 0.0
+        self._lock = threading.Lock()
+
+    def reservar(self) -> float:
+        """Consumeix una fitxa i retorna quants segons cal esperar per fer-la servir."""
+        with self._lock:
+            ara = time.monotonic()
+            self._fitxes = min(self.capacitat, self._fitxes + (ara - self._darrer) * self.taxa)
+            self._darrer = ara
+            self._fitxes -= 1
+            espera = 0.0 if self._fitxes >= 0 else -self._fitxes / self.taxa
+            return max(espera, self._pausa_fins - ara)
+
+    def pausar(self, segons: float):
+        """Atura tothom uns segons (p. ex. quan Telegram respon RetryAfter)."""
+        with self._lock:
+            self._pausa_fins = max(self._pausa_fins, time.monotonic() + segons)
+
+    async def esperar(self):
+        espera = self.reservar()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    def esperar_sync(self):
+        espera = self.reservar()
+        if espera > 0:
+            time.sleep(espera)
+
+# ----------------------------
+# Client de Google Sheets amb control de quota
+# ----------------------------
+# Google limita les lectures i les escriptures per minut (per defecte 60 de
+# cada per usuari). En lloc de rebre 429 i perdre la crida:
+# - cada crida consumeix una fitxa del bucket de lectures o d'escriptures;
+# - les escriptures passen davant: tenen fils propis (_en_executor_escriptura)
+#   i no esperen darrere de lectures encuades;
+# - lectures idèntiques simultànies comparteixen una sola crida;
+# - 429 i 5xx es reintenten amb espera exponencial amb jitter.
+# Tot és síncron: s'executa als fils dels executors de Sheets.
+_METODES_LECTURA = {"get_all_records", "get_all_values", "acell", "cell", "get", "batch_get",
+                    "row_values", "col_values", "worksheet", "open"}
+
+def _codi_error(e: Exception) -> Optional[int]:
+    codi = getattr(getattr(e, "response", None), "status_code", None)
+    if codi is None and e.args and isinstance(e.args[0], dict):
+        codi = e.args[0].get("code")
+    return codi
+
+def _fora_de_la_graella(e: Exception) -> bool:
+    """400 de Sheets quan el rang comença després de l'última fila de la graella."""
+    missatge = e.args[0].get("message", "") if e.args and isinstance(e.args[0], dict) else str(e)
+    return _codi_error(e) == 400 and "exceeds grid limits" in missatge
+
+class ClientSheetsLimitat:
+    def __init__(self, client, lectures_minut: int, escriptures_minut: int, reintents: int):
+        self.client = client
+        self.reintents = reintents
+        # 0 = sense límit
+        self._lectures = TokenBucket(lectures_minut / 60, lectures_minut / 4) if lectures_minut else None
+        self._escriptures = TokenBucket(escriptures_minut / 60, escriptures_minut / 4) if escriptures_minut else None
+        self._lock = threading.Lock()
+        self._en_vol: Dict[tuple, Future] = {}
+
+    def _amb_reintents(self, escriptura: bool, funcio: Callable[[], Any]):
+        bucket = self._escriptures if escriptura else self._lectures
+        for intent in range(self.reintents + 1):
+            if bucket:
+                bucket.esperar_sync()
+            try:
+                return funcio()
+            except gspread.exceptions.APIError as e:
+                codi = _codi_error(e)
+                if intent == self.reintents or not (codi == 429 or (codi and 500 <= codi < 600)):
+                    raise
+                espera = random.uniform(0, min(32, 2 ** intent))
+                if codi == 429:
+                    metriques.error("sheets_quota")
+                    # frenem totes les crides del mateix tipus, no només aquesta
+                    if bucket:
+                        bucket.pausar(espera)
+                print(f"⚠️ Sheets ha respost {codi}; reintent {intent + 1} en {espera:.1f} s")
+                time.sleep(espera)
+
+    def executar(self, escriptura: bool, clau: tuple, funcio: Callable[[], Any]):
+        if escriptura:
+            return self._amb_reintents(True, funcio)
+        with self._lock:
+            fut = self._en_vol.get(clau)
+            lider = fut is None
+            if lider:
+                fut = self._en_vol[clau] = Future()
+        if not lider:
+            return fut.result()
+        try:
+            resultat = self._amb_reintents(False, funcio)
+            fut.set_result(resultat)
+            return resultat
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._en_vol.pop(clau, None)
+
+    def open(self, nom: str):
+        sh = self.executar(False, ("open", nom), lambda: self.client.open(nom))
+        return DocumentLimitat(sh, nom, self)
+
+class DocumentLimitat:
+    def __init__(self, document, nom: str, client: ClientSheetsLimitat):
+        self._document = document
+        self._nom = nom
+        self._client = client
+
+    def worksheet(self, nom: str):
+        ws = self._client.executar(False, ("worksheet", self._nom, nom), lambda: self._document.worksheet(nom))
+        return FullaLimitada(FullaInstrumentada(ws, nom), nom, self._client, self._nom)
+
+class FullaLimitada:
+    """Worksheet que passa cada crida per ClientSheetsLimitat."""
+
+    def __init__(self, worksheet, nom: str, client: ClientSheetsLimitat, document: str = ""):
+        self._worksheet = worksheet
+        self._nom = nom
+        self._client = client
+        # diverses ginkanes tenen fulles amb el mateix nom: la clau inclou el document
+        self._document = document
+
+    def __getattr__(self, atribut):
+        valor = getattr(self._worksheet, atribut)
+        if not callable(valor):
+            return valor
+        escriptura = atribut not in _METODES_LECTURA
+
+        def crida(*args, **kwargs):
+            clau = (self._document, self._nom, atribut, repr(args), repr(sorted(kwargs.items())))
+            return self._client.executar(escriptura, clau, lambda: valor(*args, **kwargs))
+        return crida
 
 # ----------------------------
 # Google Sheets - credencials
@@ -37,34 +445,383 @@ creds_dict = {
     "client_x509_cert_url": os.getenv("GOOGLE_CLIENT_X509_CERT_URL")
 }
 
-gc = gspread.service_account_from_dict(creds_dict)
+# El client només es crea si algun magatzem necessita Sheets (el backend
+# SQLite ha de poder funcionar sense xarxa ni credencials). Totes les ginkanes
+# comparteixen aquesta sessió i la seva quota.
+gc = None
+_gc_limitat: Optional[ClientSheetsLimitat] = None
+
+def _client_sheets() -> ClientSheetsLimitat:
+    global gc, _gc_limitat
+    if gc is None:
+        gc = gspread.service_account_from_dict(creds_dict)
+    if _gc_limitat is None or _gc_limitat.client is not gc:
+        _gc_limitat = ClientSheetsLimitat(gc, SHEETS_LECTURES_MINUT, SHEETS_ESCRIPTURES_MINUT, SHEETS_REINTENTS)
+    return _gc_limitat
 
 # ----------------------------
-# Worksheets (obrir una sola vegada)
+# Magatzems de dades
 # ----------------------------
-# Els objectes worksheet seran assignats a l'inicialitzar el bot
-sheet_records = None
-sheet_proves = None
-sheet_equips = None
-sheet_usuaris = None
-sheet_ajuda = None
-sheet_emergencia = None
+# Tots els magatzems ofereixen la mateixa interfície síncrona (s'executa al
+# pool de _en_executor): proves, equips, records i usuaris retornen llistes de
+# dicts amb les columnes de la fulla; ajuda i emergencia el text de A1.
+# Les respostes s'identifiquen pel número de fila com a la fulla (la capçalera
+# és la 1): afegir_records retorna les files on han anat a parar i
+# decidir_records hi escriu punts i estat de les revisades.
+_CAPCALERES = {
+    "proves": ["id", "titol", "tipus", "descripcio", "punts", "resposta", "nota"],
+    "equips": ["equip", "portaveu", "jugadors", "hora_inscripcio"],
+    "punts_equips": ["equip", "prova_id", "resposta", "punts", "estat", "hora"],
+    "usuaris": ["username", "chat_id"],
+}
+_CSV_LLAVOR = {
+    "proves": "proves_ginkana.csv",
+    "equips": "equips.csv",
+    "punts_equips": "punts_equips.csv",
+    "usuaris": "usuaris.csv",
+}
+
+class MagatzemSheets:
+    """Les sis fulles del document de Google Sheets d'una ginkana."""
+
+    def __init__(self, nom_document: str):
+        # cada fulla ja ve instrumentada i limitada per ClientSheetsLimitat
+        sh = _client_sheets().open(nom_document)
+        self.sheet_records = sh.worksheet("punts_equips")
+        self.sheet_proves = sh.worksheet("proves")
+        self.sheet_equips = sh.worksheet("equips")
+        self.sheet_usuaris = sh.worksheet("usuaris")
+        self.sheet_ajuda = sh.worksheet("ajuda")
+        self.sheet_emergencia = sh.worksheet("emergencia")
+        self._capcalera_records = None
+
+    def proves(self):
+        return self.sheet_proves.get_all_records()
+
+    def equips(self):
+        return self.sheet_equips.get_all_records()
+
+    def records(self):
+        return self.sheet_records.get_all_records()
+
+    def _capcalera(self) -> list:
+        if self._capcalera_records is None:
+            self._capcalera_records = self.sheet_records.row_values(1)
+        return self._capcalera_records
+
+    def records_des_de(self, n: int):
+        """Files de dades a partir de la n+1 (només el rang nou de la fulla)."""
+        capcalera = self._capcalera()
+        ultima_columna = gspread.utils.rowcol_to_a1(1, len(capcalera))[:-1]
+        try:
+            valors = self.sheet_records.get(f"A{n + 2}:{ultima_columna}")
+        except gspread.exceptions.APIError as e:
+            # Els append omplen la graella just fins a l'última fila: si no n'hi ha
+            # cap de nova, el rang demanat ja en queda fora
+            if _fora_de_la_graella(e):
+                return []
+            raise
+        files = []
+        for fila in valors:
+            fila = numericise_all(fila + [""] * (len(capcalera) - len(fila)))
+            files.append(dict(zip(capcalera, fila)))
+        return files
+
+    def usuaris(self):
+        return self.sheet_usuaris.get_all_records()
+
+    def ajuda(self):
+        return self.sheet_ajuda.acell("A1").value
+
+    def emergencia(self):
+        return self.sheet_emergencia.acell("A1").value
+
+    def afegir_equip(self, row: list):
+        self.sheet_equips.append_row(row)
+
+    def afegir_records(self, rows: list):
+        # append_rows escriu en RAW: l'hora queda com a text, tal qual, sense convertir-la
+        resposta = self.sheet_records.append_rows(rows)
+        # p. ex. "punts_equips!A12:F14": la primera fila escrita és la 12
+        rang = ((resposta or {}).get("updates") or {}).get("updatedRange", "")
+        m = re.search(r"![A-Z]+(\d+)", rang)
+        return list(range(int(m.group(1)), int(m.group(1)) + len(rows))) if m else None
+
+    def decidir_records(self, decisions: list):
+        """decisions: (fila, punts, estat). Tot en una sola crida batch_update."""
+        capcalera = self._capcalera()
+        col_punts = capcalera.index("punts") + 1
+        col_estat = capcalera.index("estat") + 1
+        canvis = []
+        for fila, punts, estat in decisions:
+            canvis.append({"range": gspread.utils.rowcol_to_a1(fila, col_punts), "values": [[punts]]})
+            canvis.append({"range": gspread.utils.rowcol_to_a1(fila, col_estat), "values": [[estat]]})
+        self.sheet_records.batch_update(canvis)
+
+    def afegir_usuari(self, row: list):
+        self.sheet_usuaris.append_row(row)
+
+class MagatzemSQLite:
+    """Magatzem local. Si les taules són buides s'omplen amb els CSV del repo."""
+
+    def __init__(self, path: str, dir_llavor: str = "."):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS proves (id INTEGER PRIMARY KEY, titol TEXT, tipus TEXT,
+                    descripcio TEXT, punts INTEGER, resposta TEXT, nota TEXT);
+                CREATE TABLE IF NOT EXISTS equips (equip TEXT, portaveu TEXT, jugadors TEXT, hora_inscripcio TEXT);
+                CREATE TABLE IF NOT EXISTS punts_equips (equip TEXT, prova_id INTEGER, resposta TEXT,
+                    punts INTEGER, estat TEXT, hora TEXT);
+                CREATE TABLE IF NOT EXISTS usuaris (username TEXT, chat_id INTEGER);
+                CREATE TABLE IF NOT EXISTS textos (nom TEXT PRIMARY KEY, valor TEXT);
+            """)
+        self._sembrar(dir_llavor)
+
+    def _sembrar(self, dir_llavor: str):
+        with self._lock, self._db:
+            for taula, fitxer in _CSV_LLAVOR.items():
+                path = os.path.join(dir_llavor, fitxer)
+                buida = self._db.execute(f"SELECT COUNT(*) FROM {taula}").fetchone()[0] == 0
+                if not buida or not os.path.exists(path):
+                    continue
+                with open(path, encoding="utf-8", newline="") as f:
+                    files = [[row.get(c, "") for c in _CAPCALERES[taula]] for row in csv.DictReader(f)]
+                marques = ",".join("?" * len(_CAPCALERES[taula]))
+                self._db.executemany(f"INSERT INTO {taula} VALUES ({marques})", files)
+            for nom in ("ajuda", "emergencia"):
+                path = os.path.join(dir_llavor, f"{nom}.txt")
+                if os.path.exists(path):
+                    with open(path, encoding="utf-8") as f:
+                        self._db.execute("INSERT OR IGNORE INTO textos VALUES (?, ?)", (nom, f.read()))
+
+    def _llegir(self, taula: str):
+        with self._lock:
+            return [dict(r) for r in self._db.execute(f"SELECT * FROM {taula} ORDER BY rowid")]
+
+    def _text(self, nom: str):
+        with self._lock:
+            row = self._db.execute("SELECT valor FROM textos WHERE nom = ?", (nom,)).fetchone()
+        return row["valor"] if row else None
+
+    def _afegir(self, taula: str, rows: list) -> list:
+        marques = ",".join("?" * len(_CAPCALERES[taula]))
+        with self._lock, self._db:
+            self._db.executemany(f"INSERT INTO {taula} VALUES ({marques})", rows)
+            darrer = self._db.execute(f"SELECT MAX(rowid) FROM {taula}").fetchone()[0]
+        # rowid 1 és la primera fila de dades: com a la fulla, la fila 2
+        return list(range(darrer - len(rows) + 2, darrer + 2))
+
+    def proves(self):
+        return self._llegir("proves")
+
+    def equips(self):
+        return self._llegir("equips")
+
+    def records(self):
+        return self._llegir("punts_equips")
+
+    def records_des_de(self, n: int):
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM punts_equips ORDER BY rowid LIMIT -1 OFFSET ?", (n,))
+            return [dict(r) for r in cursor]
+
+    def usuaris(self):
+        return self._llegir("usuaris")
+
+    def ajuda(self):
+        return self._text("ajuda")
+
+    def emergencia(self):
+        return self._text("emergencia")
+
+    def afegir_equip(self, row: list):
+        self._afegir("equips", [row])
+
+    def afegir_records(self, rows: list):
+        return self._afegir("punts_equips", rows)
+
+    def decidir_records(self, decisions: list):
+        with self._lock, self._db:
+            self._db.executemany("UPDATE punts_equips SET punts = ?, estat = ? WHERE rowid = ?",
+                                 [(punts, estat, fila - 1) for fila, punts, estat in decisions])
+
+    def claus_de_files(self, files: list) -> dict:
+        """fila -> (equip, prova_id) de les respostes d'aquestes files."""
+        marques = ",".join("?" * len(files))
+        with self._lock:
+            cursor = self._db.execute(f"SELECT rowid, equip, prova_id FROM punts_equips WHERE rowid IN ({marques})",
+                                      [fila - 1 for fila in files])
+            return {r["rowid"] + 1: (r["equip"], str(r["prova_id"])) for r in cursor}
+
+    def afegir_usuari(self, row: list):
+        self._afegir("usuaris", [row])
+
+class MagatzemMirall:
+    """Llegeix i escriu al magatzem principal i replica les escriptures a un mirall.
+
+    Serveix per tenir el camí calent en SQLite i Google Sheets només com a
+    còpia per als organitzadors: si el mirall falla, l'error es registra i
+    la dada ja és segura al principal. Les files de les respostes no tenen
+    per què coincidir (el mirall pot tenir files d'abans o haver perdut un
+    append): es guarda la correspondència que retorna cada append i, si no
+    hi és, la fila del mirall es busca per (equip, prova_id).
+    """
+
+    def __init__(self, principal, mirall):
+        self.principal = principal
+        self.mirall = mirall
+        self._files_mirall: Dict[int, int] = {}   # fila al principal -> fila al mirall
+
+    def __getattr__(self, nom):
+        # lectures: sempre del principal
+        return getattr(self.principal, nom)
+
+    def _replicar(self, metode: str, arg):
+        resultat = getattr(self.principal, metode)(arg)
+        try:
+            getattr(self.mirall, metode)(arg)
+        except Exception as e:
+            print(f"⚠️ Error replicant {metode} al mirall: {e}")
+        return resultat
+
+    def afegir_equip(self, row: list):
+        self._replicar("afegir_equip", row)
+
+    def afegir_records(self, rows: list):
+        files = self.principal.afegir_records(rows)
+        try:
+            files_mirall = self.mirall.afegir_records(rows)
+        except Exception as e:
+            print(f"⚠️ Error replicant afegir_records al mirall: {e}")
+            return files
+        if files and files_mirall:
+            self._files_mirall.update(zip(files, files_mirall))
+        return files
+
+    def _buscar_files_mirall(self, files: list) -> Dict[int, list]:
+        """Files del mirall de les respostes que no hem vist afegir (p. ex. després d'arrencar)."""
+        claus = self.principal.claus_de_files(files)
+        per_clau: Dict[tuple, list] = {}
+        for posicio, row in enumerate(self.mirall.records()):
+            per_clau.setdefault((row.get("equip"), str(row.get("prova_id"))), []).append(posicio + 2)
+        # si el mirall té la resposta duplicada (entrega com a mínim una vegada), totes
+        return {fila: per_clau.get(clau, []) for fila, clau in claus.items()}
+
+    def decidir_records(self, decisions: list):
+        self.principal.decidir_records(decisions)
+        try:
+            desconegudes = [fila for fila, _punts, _estat in decisions if fila not in self._files_mirall]
+            trobades = self._buscar_files_mirall(desconegudes) if desconegudes else {}
+            decisions_mirall = []
+            for fila, punts, estat in decisions:
+                files_mirall = [self._files_mirall[fila]] if fila in self._files_mirall else trobades.get(fila, [])
+                if not files_mirall:
+                    print(f"⚠️ La resposta de la fila {fila} no és al mirall: no s'hi escriu la decisió")
+                decisions_mirall += [(f, punts, estat) for f in files_mirall]
+            if decisions_mirall:
+                self.mirall.decidir_records(decisions_mirall)
+        except Exception as e:
+            print(f"⚠️ Error replicant decidir_records al mirall: {e}")
+
+    def afegir_usuari(self, row: list):
+        self._replicar("afegir_usuari", row)
+
+# Cada ginkana té el seu magatzem (Esdeveniment.magatzem); s'obre a l'arrencar
+def init_magatzem(e: "Esdeveniment" = None):
+    e = e or esdeveniment()
+    if GINKANA_BACKEND == "sqlite":
+        magatzem = MagatzemSQLite(e.path_sqlite, GINKANA_DIR_LLAVOR)
+        if GINKANA_MIRALL_SHEETS:
+            magatzem = MagatzemMirall(magatzem, MagatzemSheets(e.document))
+    else:
+        magatzem = MagatzemSheets(e.document)
+    e.magatzem = magatzem
+    # S'activa quan el magatzem està obert; fins llavors les crides l'esperen
+    e.llest.set()
+
+def _init_magatzem_en_fons(e: "Esdeveniment"):
+    """Obre el magatzem en un fil propi, reintentant fins que ho aconsegueix."""
+    espera = 1
+    while True:
+        try:
+            init_magatzem(e)
+            print(f"✅ Magatzem obert ({e.nom})")
+            return
+        except Exception as ex:
+            print(f"⚠️ No s'ha pogut obrir el magatzem de {e.nom}, reintent en {espera} s: {ex}")
+            time.sleep(espera)
+            espera = min(espera * 2, 60)
+
+def _magatzem():
+    """Magatzem de la ginkana activa."""
+    return esdeveniment().magatzem
 
-def init_worksheets():
-    global sheet_records, sheet_proves, sheet_equips, sheet_usuaris, sheet_ajuda, sheet_emergencia
-    sh = gc.open(GINKANA_PUNTS_SHEET)
-    sheet_records = sh.worksheet("punts_equips")
-    sheet_proves = sh.worksheet("proves")
-    sheet_equips = sh.worksheet("equips")
-    sheet_usuaris = sh.worksheet("usuaris")
-    sheet_ajuda = sh.worksheet("ajuda")
-    sheet_emergencia = sh.worksheet("emergencia")
+async def _esperar_magatzem():
+    llest = esdeveniment().llest
+    if not llest.is_set():
+        await asyncio.to_thread(llest.wait)
+
+# ----------------------------
+# Executor per a les crides bloquejants de gspread
+# ----------------------------
+# gspread és síncron: cada crida és un round-trip HTTP de 300-800 ms. Les
+# executem en un pool de fils acotat perquè el bucle d'asyncio continuï
+# atenent la resta d'equips mentre una lectura o escriptura és en vol.
+_SHEETS_EXECUTOR = ThreadPoolExecutor(max_workers=SHEETS_CONCURRENCY, thread_name_prefix="sheets")
+# Les escriptures tenen fils propis: mai esperen darrere d'una cua de lectures
+_SHEETS_EXECUTOR_ESCRIPTURA = ThreadPoolExecutor(max_workers=SHEETS_CONCURRENCY_ESCRIPTURA,
+                                                 thread_name_prefix="sheets-w")
+
+async def _en_executor(func: Callable[..., Any], *args, **kwargs):
+    """Executa func(*args, **kwargs) al pool de Sheets sense bloquejar el bucle."""
+    await _esperar_magatzem()
+    loop = asyncio.get_running_loop()
+    # run_in_executor no copia el context: sense això el fil no sabria de quina ginkana és
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_SHEETS_EXECUTOR, functools.partial(context.run, func, *args, **kwargs))
+
+async def _en_executor_escriptura(func: Callable[..., Any], *args, **kwargs):
+    """Com _en_executor, però al pool prioritari de les escriptures."""
+    await _esperar_magatzem()
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_SHEETS_EXECUTOR_ESCRIPTURA, functools.partial(context.run, func, *args, **kwargs))
+
+# Escriptures que el handler no ha d'esperar (p. ex. el chat_id a /inscriure).
+# Guardem les tasques perquè no les reculli el GC abans d'acabar.
+_ESCRIPTURES_EN_SEGON_PLA: set = set()
+
+def escriure_en_segon_pla(coro):
+    """Llança l'escriptura com a tasca (hereta la ginkana activa) sense esperar-la."""
+    tasca = asyncio.ensure_future(coro)
+    _ESCRIPTURES_EN_SEGON_PLA.add(tasca)
+
+    def _fi(t):
+        _ESCRIPTURES_EN_SEGON_PLA.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            print(f"⚠️ Error en una escriptura en segon pla: {t.exception()}")
+    tasca.add_done_callback(_fi)
+    return tasca
+
+async def esperar_escriptures_en_segon_pla():
+    """Espera les escriptures en segon pla pendents (en aturar-se)."""
+    if _ESCRIPTURES_EN_SEGON_PLA:
+        await asyncio.gather(*list(_ESCRIPTURES_EN_SEGON_PLA), return_exceptions=True)
 
 # ----------------------------
 # Cache per worksheet
 # ----------------------------
 # Estratègia: cache_get / cache_invalidate
-_CACHE: Dict[str, Tuple[Any, datetime.datetime, int]] = {}
+# - Les càrregues concurrents d'una mateixa clau comparteixen una sola crida
+#   (single-flight): una ràfega de /ranking just després d'expirar fa un sol
+#   get_all_records.
+# - Una entrada caducada es serveix tal qual mentre es refresca en segon pla
+#   (stale-while-revalidate). Només es bloqueja si no hi ha cap valor.
+# - Les claus de _CACHE_REFRESC_PROACTIU es refresquen abans que caduquin.
+# Les entrades són de la ginkana activa (Esdeveniment.cache: nom -> (valor, ts, ttl)).
 # TTLs en segons per cada tipus de dades
 _CACHE_TTLS = {
     "proves": 3600,       # gairebé fixen
@@ -74,125 +831,854 @@ _CACHE_TTLS = {
     "ajuda": 30,
     "emergencia": 30
 }
+# Claus que la tasca de fons refresca quan han consumit aquesta fracció del TTL
+_CACHE_REFRESC_PROACTIU = ("proves", "equips")
+_CACHE_FRACCIO_REFRESC = 0.8
 
 def _now():
     return datetime.datetime.now(MADRID_TZ)
 
-def cache_get(name: str, loader: Callable[[], Any], ttl_override: Optional[int] = None):
+def _cache_stat(name: str, camp: str):
+    stats = esdeveniment().cache_stats.setdefault(name, {"hits": 0, "stale": 0, "misses": 0, "refrescos": 0, "errors": 0})
+    stats[camp] += 1
+
+async def _cache_carregar(name: str, loader: Callable[[], Any], ttl: int):
+    e = esdeveniment()
+    # Cada invalidació incrementa la generació: una càrrega iniciada abans no es desa
+    generacio = e.cache_generacio.get(name, 0)
+    try:
+        value = await _en_executor(loader)
+    except Exception:
+        _cache_stat(name, "errors")
+        raise
+    _cache_stat(name, "refrescos")
+    if e.cache_generacio.get(name, 0) == generacio:
+        e.cache[name] = (value, _now(), ttl)
+    return value
+
+def _cache_carrega_compartida(name: str, loader: Callable[[], Any], ttl: int) -> asyncio.Future:
+    """Retorna la càrrega en vol de la clau o n'engega una de nova."""
+    carregant = esdeveniment().cache_carregant
+    fut = carregant.get(name)
+    if fut is None:
+        # la tasca hereta el context: es carrega a la mateixa ginkana
+        fut = asyncio.ensure_future(_cache_carregar(name, loader, ttl))
+        carregant[name] = fut
+
+        def _fi(f):
+            carregant.pop(name, None)
+            if not f.cancelled() and f.exception() is not None:
+                print(f"⚠️ Error refrescant la cache '{name}': {f.exception()}")
+        fut.add_done_callback(_fi)
+    return fut
+
+async def cache_get(name: str, loader: Callable[[], Any], ttl_override: Optional[int] = None):
     """
-    Retorna el valor cachejat o recarrega amb loader().
+    Retorna el valor cachejat o recarrega amb loader() (executat fora del bucle).
     name: clau de cache
-    loader: funció que retorna les dades actuals
+    loader: funció síncrona que retorna les dades actuals
     ttl_override: si es vol un TTL diferent a _CACHE_TTLS
     """
     ttl = ttl_override if ttl_override is not None else _CACHE_TTLS.get(name, 10)
-    entry = _CACHE.get(name)
+    e = esdeveniment()
+    e.cache_loaders[name] = loader
+    entry = e.cache.get(name)
     if entry:
         value, ts, entry_ttl = entry
         age = (_now() - ts).total_seconds()
         if age <= entry_ttl:
+            _cache_stat(name, "hits")
             return value
-    # recarregar
-    value = loader()
-    _CACHE[name] = (value, _now(), ttl)
-    return value
+        # caducada: la servim i refresquem en segon pla
+        _cache_stat(name, "stale")
+        _cache_carrega_compartida(name, loader, ttl)
+        return value
+    # sense valor: esperem la càrrega (compartida amb les altres peticions)
+    _cache_stat(name, "misses")
+    return await asyncio.shield(_cache_carrega_compartida(name, loader, ttl))
 
 def cache_invalidate(name: str):
-    if name in _CACHE:
-        del _CACHE[name]
+    e = esdeveniment()
+    e.cache_generacio[name] = e.cache_generacio.get(name, 0) + 1
+    if name in e.cache:
+        del e.cache[name]
+
+def cache_caducar(name: str):
+    """Marca el valor com a caducat sense treure'l: el següent ús el serveix i
+    el refresca en segon pla en lloc d'esperar una lectura."""
+    e = esdeveniment()
+    e.cache_generacio[name] = e.cache_generacio.get(name, 0) + 1
+    entry = e.cache.get(name)
+    if entry:
+        value, _ts, ttl = entry
+        e.cache[name] = (value, datetime.datetime.min.replace(tzinfo=MADRID_TZ), ttl)
+
+def cache_actualitzat(name: str):
+    """El valor cachejat s'ha modificat in situ: descarta les càrregues en vol."""
+    e = esdeveniment()
+    e.cache_generacio[name] = e.cache_generacio.get(name, 0) + 1
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Comptadors per clau: hits, stale, misses, refrescos i errors."""
+    esdeveniments = list(_ESDEVENIMENTS.values())
+    stats = {}
+    for e in esdeveniments:
+        # amb una sola ginkana les claus queden com sempre
+        prefix = f"{e.nom}/" if len(esdeveniments) > 1 else ""
+        stats.update({prefix + name: dict(s) for name, s in e.cache_stats.items()})
+    return stats
+
+async def bucle_refresc_cache(interval: float = 5):
+    """Tasca de fons: refresca les claus proactives abans que caduquin i allibera
+    la cache de les ginkanes que fa GINKANA_INACTIVA segons que ningú fa servir."""
+    while True:
+        await asyncio.sleep(interval)
+        for e in list(_ESDEVENIMENTS.values()):
+            if e.inactiva():
+                e.alliberar_cache()
+                continue
+            token = _ESDEVENIMENT_ACTUAL.set(e)
+            try:
+                for name in _CACHE_REFRESC_PROACTIU:
+                    entry = e.cache.get(name)
+                    loader = e.cache_loaders.get(name)
+                    if not entry or not loader:
+                        continue
+                    _value, ts, ttl = entry
+                    if (_now() - ts).total_seconds() >= ttl * _CACHE_FRACCIO_REFRESC:
+                        _cache_carrega_compartida(name, loader, ttl)
+            finally:
+                _ESDEVENIMENT_ACTUAL.reset(token)
+
+# ----------------------------
+# Versions de les dades
+# ----------------------------
+# Cada canvi a proves, equips o respostes incrementa la seva versió. Els
+# missatges renderitzats (/ranking, /ekips, /proves) es guarden amb la
+# versió amb què es van generar i es reutilitzen mentre no canviï. Cada
+# ginkana té les seves (Esdeveniment.versions).
+def _versio(nom: str) -> int:
+    return esdeveniment().versions[nom]
+
+def _nova_versio(nom: str):
+    esdeveniment().versions[nom] += 1
+
+# ----------------------------
+# Índexs d'identitat (equips i usuaris)
+# ----------------------------
+# Es construeixen al loader juntament amb les dades i s'actualitzen in situ
+# a guardar_equip / guardar_chat_id: les comprovacions de portaveu, nom
+# d'equip o chat_id són O(1) i no fan cap lectura de la fulla.
+class IndexEquips:
+    def __init__(self):
+        self.equips: Dict[str, dict] = {}
+        self.per_portaveu: Dict[str, str] = {}   # portaveu (username o first_name) -> equip
+        self.noms: set = set()                   # noms d'equip en minúscules
+        self.duplicats: list = []                # noms d'equip repetits a la fulla
+
+    def afegir(self, equip: str, portaveu: str, jugadors: list, hora_inscripcio: str = ""):
+        portaveu = portaveu.lstrip("@").lower()
+        if equip.lower() in self.noms:
+            self.duplicats.append(equip)
+        self.equips[equip] = {
+            "portaveu": portaveu,
+            "jugadors": jugadors,
+            "hora_inscripcio": hora_inscripcio
+        }
+        self.noms.add(equip.lower())
+        # com abans, si un portaveu surt dues vegades mana el primer equip
+        self.per_portaveu.setdefault(portaveu, equip)
+        _nova_versio("equips")
+
+    def treure(self, equip: str):
+        info = self.equips.pop(equip, None)
+        if info is None:
+            return
+        self.noms.discard(equip.lower())
+        if self.per_portaveu.get(info["portaveu"]) == equip:
+            del self.per_portaveu[info["portaveu"]]
+        _nova_versio("equips")
+
+    def equip_de(self, username: str, firstname: str) -> Optional[str]:
+        for clau in (username, firstname):
+            if clau and clau in self.per_portaveu:
+                return self.per_portaveu[clau]
+        return None
+
+class IndexUsuaris:
+    def __init__(self):
+        self.chat_ids: set = set()
+        self.per_username: Dict[str, int] = {}
+        self.duplicats: list = []                # chat_ids repetits a la fulla
+
+    def afegir(self, username: str, chat_id: int):
+        if chat_id in self.chat_ids:
+            self.duplicats.append(chat_id)
+        self.chat_ids.add(chat_id)
+        if username:
+            self.per_username[str(username).lower()] = chat_id
+
+# ----------------------------
+# Validació de respostes
+# ----------------------------
+# Per a cada prova es compila (un cop, al loader de proves) el conjunt de
+# respostes acceptades ja normalitzades: sense accents, majúscules, espais ni
+# puntuació, i amb dates i números en forma canònica. Així "Pà", "1 992" o
+# "11/09/1918" encaixen amb "pa", "1992" i "11-09-1918" amb una sola consulta
+# al frozenset. Opcionalment, per tipus, s'accepta una distància d'edició
+# acotada contra les alternatives de text (mai contra números o dates).
+_RE_DATA = re.compile(r"^(\d{1,2})\s*[-/.\s]\s*(\d{1,2})\s*[-/.\s]\s*(\d{4})$")
+_RE_DATA_ISO = re.compile(r"^(\d{4})\s*[-/.]\s*(\d{1,2})\s*[-/.]\s*(\d{1,2})$")
+_RE_ENTER = re.compile(r"^[+-]?(\d{1,3}([ .]\d{3})+|\d+)$")
+_RE_DECIMAL = re.compile(r"^[+-]?\d+[.,]\d+$")
+
+def _distancies_per_tipus(valor: str) -> Dict[str, int]:
+    distancies = {}
+    for parell in valor.split(","):
+        if ":" in parell:
+            tipus, distancia = parell.split(":", 1)
+            distancies[tipus.strip()] = int(distancia)
+    return distancies
+
+_DISTANCIA_PER_TIPUS = _distancies_per_tipus(RESPOSTA_DISTANCIA)
+
+def normalitzar_resposta(text) -> str:
+    text = " ".join(str(text).split())
+    m = _RE_DATA.match(text)
+    if m:
+        dia, mes, any_ = (int(x) for x in m.groups())
+        return f"{any_:04d}-{mes:02d}-{dia:02d}"
+    m = _RE_DATA_ISO.match(text)
+    if m:
+        any_, mes, dia = (int(x) for x in m.groups())
+        return f"{any_:04d}-{mes:02d}-{dia:02d}"
+    if _RE_ENTER.match(text):
+        return str(int(text.replace(" ", "").replace(".", "")))
+    if _RE_DECIMAL.match(text):
+        return repr(float(text.replace(",", ".")))
+    sense_accents = unicodedata.normalize("NFKD", text.casefold())
+    normalitzada = "".join(c for c in sense_accents if c.isalnum())
+    # només puntuació ("?!"): es compara tal qual, o qualsevol altra puntuació hi encaixaria
+    return normalitzada or text.casefold()
+
+def _distancia_acotada(a: str, b: str, maxim: int) -> int:
+    """Distància de Damerau (transposicions adjacents); para en passar de maxim."""
+    if abs(len(a) - len(b)) > maxim:
+        return maxim + 1
+    previa2, previa = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        actual = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            actual[j] = min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                actual[j] = min(actual[j], previa2[j - 2] + 1)
+        if min(actual) > maxim:
+            return maxim + 1
+        previa2, previa = previa, actual
+    return previa[-1]
+
+class MatcherResposta:
+    __slots__ = ("origen", "exactes", "distancia", "textos")
+
+    def __init__(self, resposta_correcta: str, tipus: str):
+        self.origen = resposta_correcta
+        self.exactes = frozenset(
+            normalitzar_resposta(r) for r in resposta_correcta.split("|") if r.strip()
+        )
+        self.distancia = _DISTANCIA_PER_TIPUS.get(tipus, 0)
+        # només alternatives de lletres prou llargues: "sol" i "sal" no s'han de
+        # confondre, ni números, dates o puntuació
+        self.textos = tuple(
+            r for r in self.exactes
+            if len(r) >= RESPOSTA_LONGITUD_APROXIMADA and r.isalpha()
+        ) if self.distancia else ()
+
+    def encaixa(self, resposta) -> bool:
+        normalitzada = normalitzar_resposta(resposta)
+        if normalitzada in self.exactes:
+            return True
+        return any(
+            _distancia_acotada(normalitzada, r, self.distancia) <= self.distancia
+            for r in self.textos
+        )
+
+def compilar_matchers(proves: dict):
+    # diccionari nou i assignat de cop: les validacions en curs no veuen mai un estat a mitges
+    esdeveniment().matchers = {
+        pid: MatcherResposta(str(prova["resposta"]), prova["tipus"]) for pid, prova in proves.items()
+    }
+
+def matcher_de(prova) -> MatcherResposta:
+    pid = str(prova["id"])
+    matchers = esdeveniment().matchers
+    matcher = matchers.get(pid)
+    # per si les proves han arribat per un altre camí (snapshot) o han canviat
+    if matcher is None or matcher.origen != str(prova["resposta"]):
+        matcher = matchers[pid] = MatcherResposta(str(prova["resposta"]), prova["tipus"])
+    return matcher
 
 # ----------------------------
 # Helpers Google Sheets (amb cache)
 # ----------------------------
-def carregar_proves():
+async def carregar_proves():
     def loader():
-        rows = sheet_proves.get_all_records()
+        rows = _magatzem().proves()
         proves = {str(int(row["id"])): row for row in rows}
+        compilar_matchers(proves)
+        _nova_versio("proves")
         return proves
-    return cache_get("proves", loader)
+    return await cache_get("proves", loader)
 
-def carregar_equips():
+async def index_equips() -> IndexEquips:
     def loader():
-        rows = sheet_equips.get_all_records()
-        equips = {}
+        rows = _magatzem().equips()
+        index = IndexEquips()
         for row in rows:
-            equips[row["equip"]] = {
-                "portaveu": row["portaveu"].lstrip("@").lower(),
-                "jugadors": [j.strip() for j in row["jugadors"].split(",") if j.strip()],
-                "hora_inscripcio": row.get("hora_inscripcio", "")
-            }
-        return equips
-    return cache_get("equips", loader)
-
-def get_records():
-    def loader():
-        return sheet_records.get_all_records()
-    return cache_get("records", loader)
-
-def carregar_ajuda():
+            index.afegir(
+                str(row["equip"]),
+                str(row["portaveu"]),
+                [j.strip() for j in str(row["jugadors"]).split(",") if j.strip()],
+                row.get("hora_inscripcio", "")
+            )
+        if index.duplicats:
+            print(f"⚠️ Noms d'equip duplicats a la fulla equips: {index.duplicats}")
+        return index
+    return await cache_get("equips", loader)
+
+async def carregar_equips():
+    return (await index_equips()).equips
+
+# punts_equips només creix (guardar_submission): en lloc de rellegir-la sencera
+# a cada TTL en baixem només les files noves. Cada RECORDS_RECONCILIACIO
+# segons es fa una lectura completa per recollir les revisions manuals de
+# respostes PENDENT. L'estat de la sincronització és per ginkana
+# (Esdeveniment.sync_records).
+class LlistaRecords(list):
+    """Records llegits. `lectura` identifica la lectura completa d'on surten: una
+    sincronització de cua fa una llista nova (el loader corre en un fil i la de
+    la cache la pot estar llegint el bucle) que en conserva la lectura."""
+
+    def __init__(self, files=(), lectura=None):
+        super().__init__(files)
+        self.lectura = lectura if lectura is not None else object()
+
+def _carregar_records():
+    sync = esdeveniment().sync_records
+    llista = sync["llista"]
+    if llista is None or time.monotonic() - sync["reconciliat"] >= RECORDS_RECONCILIACIO:
+        llista = LlistaRecords(_magatzem().records())
+        sync["reconciliat"] = time.monotonic()
+    else:
+        noves = _magatzem().records_des_de(len(llista))
+        if noves:
+            llista = LlistaRecords(llista + noves, llista.lectura)
+    sync["llista"] = llista
+    return llista
+
+async def _records_fulla():
+    return await cache_get("records", _carregar_records)
+
+async def index_respostes() -> "IndexRespostes":
+    """Retorna l'índex per equip, al dia amb l'última lectura de la fulla."""
+    records = await _records_fulla()
+    e = esdeveniment()
+    index = e.respostes
+    if records.lectura is not index.origen:
+        # reconciliació completa: fulla + respostes encara a la cua
+        index.reconstruir(records, e.cua.files_pendents())
+    elif len(records) > index.n_origen:
+        # sincronització de cua: només les files noves
+        index.aplicar_noves(records)
+    return index
+
+async def carregar_ajuda():
     def loader():
         try:
-            return sheet_ajuda.acell("A1").value or "ℹ️ Encara no hi ha ajuda definida."
+            return _magatzem().ajuda() or "ℹ️ Encara no hi ha ajuda definida."
         except Exception:
             return "ℹ️ Encara no hi ha ajuda definida."
-    return cache_get("ajuda", loader)
+    return await cache_get("ajuda", loader)
 
-def carregar_emergencia():
+async def carregar_emergencia():
     def loader():
         try:
-            return sheet_emergencia.acell("A1").value or "ℹ️ No hi ha cap missatge d'emergència definit."
+            return _magatzem().emergencia() or "ℹ️ No hi ha cap missatge d'emergència definit."
         except Exception:
             return "ℹ️ No hi ha cap missatge d'emergència definit."
-    return cache_get("emergencia", loader)
+    return await cache_get("emergencia", loader)
 
-def carregar_chat_ids():
+async def index_usuaris() -> IndexUsuaris:
     def loader():
-        chat_ids = set()
-        rows = sheet_usuaris.get_all_records()
+        index = IndexUsuaris()
+        rows = _magatzem().usuaris()
         for row in rows:
             try:
-                chat_ids.add(int(row["chat_id"]))
+                index.afegir(row.get("username", ""), int(row["chat_id"]))
             except Exception:
                 print(f"⚠️ Chat ID invàlid a usuaris sheet: {row.get('chat_id')}")
-        return list(chat_ids)
-    return cache_get("usuaris", loader)
+        return index
+    return await cache_get("usuaris", loader)
+
+async def carregar_chat_ids():
+    return list((await index_usuaris()).chat_ids)
+
+# ----------------------------
+# Índex de respostes per equip
+# ----------------------------
+# Evita recórrer tots els records a cada consulta: per a cada equip guardem
+# l'estat de cada prova resposta, els punts acumulats, les correctes, el bloc
+# actual i la línia de temps (hores ja convertides a segons del dia): la
+# primera resposta, la darrera correcta i quan s'ha acabat cada bloc. Tot
+# s'actualitza en O(1) a cada guardar_submission i es reconstrueix sencer
+# quan es torna a llegir punts_equips. També guarda les respostes PENDENT
+# amb la seva fila per a la revisió (/pendents).
+_PROVES_PER_BLOC = 10
+
+def _segons_hora(hora) -> Optional[int]:
+    """'HH:MM[:SS]' -> segons des de mitjanit; None si no és una hora."""
+    hora = str(hora).strip()
+    # files antigues: fórmula ="HH:MM:SS" desada com a text, o text forçat amb '
+    if hora.startswith('="') and hora.endswith('"'):
+        hora = hora[2:-1]
+    hora = hora.lstrip("'")
+    try:
+        parts = [int(p) for p in hora.split(":")]
+    except ValueError:
+        return None
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3:
+        return None
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+def _format_segons(segons: Optional[int]) -> str:
+    if segons is None:
+        return ""
+    return f"{segons // 3600:02d}:{segons % 3600 // 60:02d}:{segons % 60:02d}"
+
+def _bloc_de_prova(pid: str) -> Optional[int]:
+    """Índex (0-2) del bloc de 10 proves on és la prova; None per a les del bloc final."""
+    try:
+        n = int(pid)
+    except ValueError:
+        return None
+    return (n - 1) // _PROVES_PER_BLOC if 1 <= n <= 3 * _PROVES_PER_BLOC else None
+
+def _maxim(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    return b if a is None else a if b is None else max(a, b)
+
+def _equip_buit() -> dict:
+    return {"estats": {}, "punts": 0, "correctes": 0, "contestades": 0, "bloc": 1,
+            # línia de temps, en segons del dia
+            "respostes_blocs": [0, 0, 0], "darrera_blocs": [None, None, None],
+            "fi_blocs": [None, None, None], "inici": None, "darrera_correcta": None}
+
+def _actualitzar_bloc(e: dict):
+    # el bloc final s'obre amb les proves 1-29 contestades (la 30 no cal)
+    n1, n2, n3 = e["respostes_blocs"]
+    if n1 < _PROVES_PER_BLOC:
+        e["bloc"] = 1
+    elif n2 < _PROVES_PER_BLOC:
+        e["bloc"] = 2
+    elif n3 - ("30" in e["estats"]) < _PROVES_PER_BLOC - 1:
+        e["bloc"] = 3
+    else:
+        e["bloc"] = 4  # Bloc final amb pregunta secreta i final_joc
+
+def _clau_classificacio(item: tuple) -> tuple:
+    # empat de punts: guanya qui ha acabat abans les 30 proves, després qui ha
+    # encertat abans la darrera
+    equip, e = item
+    sense = float("inf")
+    fi30 = e["fi_blocs"][2]
+    return (-e["punts"], sense if fi30 is None else fi30,
+            sense if e["darrera_correcta"] is None else e["darrera_correcta"], equip.lower())
+
+class IndexRespostes:
+    def __init__(self):
+        self.equips: Dict[str, dict] = {}
+        # (equip, prova_id) -> {"resposta", "hora", "fila", "row"}; fila None si encara és a la cua
+        self.pendents: Dict[Tuple[str, str], dict] = {}
+        self.origen = None   # lectura completa de records (LlistaRecords.lectura) d'on surt
+        self.n_origen = 0    # files d'origen ja aplicades
+
+    def reconstruir(self, records: LlistaRecords, pendents: list = ()):
+        self.equips = {}
+        self.pendents = {}
+        for posicio, row in enumerate(records):
+            self.registrar(row, posicio + 2)
+        for row in pendents:
+            self.registrar(row)
+        self.origen = records.lectura
+        self.n_origen = len(records)
+        _nova_versio("records")
+
+    def aplicar_noves(self, records: LlistaRecords):
+        # les que ja s'havien registrat en local (des de la cua) no es tornen a comptar
+        n = len(records)
+        for posicio in range(self.n_origen, n):
+            self.registrar(records[posicio], posicio + 2)
+        self.n_origen = n
+
+    def registrar(self, row: dict, fila: Optional[int] = None) -> bool:
+        """Afegeix una resposta. Si l'equip ja tenia aquesta prova no la torna a comptar."""
+        e = self.equips.setdefault(row["equip"], _equip_buit())
+        pid = str(row["prova_id"])
+        if pid in e["estats"]:
+            if fila is not None:
+                # la teníem de la cua: ara ja sabem a quina fila és
+                self.assignar_fila(row["equip"], pid, fila, row)
+            return False
+        e["estats"][pid] = row["estat"]
+        e["contestades"] += 1
+        segons = _segons_hora(row.get("hora"))
+        if segons is not None and (e["inici"] is None or segons < e["inici"]):
+            e["inici"] = segons
+        if row["estat"] == "VALIDADA":
+            e["punts"] += int(row["punts"])
+            e["correctes"] += 1
+            e["darrera_correcta"] = _maxim(e["darrera_correcta"], segons)
+        elif row["estat"] == "PENDENT":
+            self.pendents[(row["equip"], pid)] = {
+                "resposta": row.get("resposta", ""), "hora": row.get("hora"), "fila": fila, "row": row
+            }
+        bloc = _bloc_de_prova(pid)
+        if bloc is not None:
+            e["respostes_blocs"][bloc] += 1
+            e["darrera_blocs"][bloc] = _maxim(e["darrera_blocs"][bloc], segons)
+            if e["respostes_blocs"][bloc] == _PROVES_PER_BLOC:
+                e["fi_blocs"][bloc] = e["darrera_blocs"][bloc]
+            _actualitzar_bloc(e)
+        _nova_versio("records")
+        return True
+
+    def assignar_fila(self, equip: str, prova_id: str, fila: int, row: Optional[dict] = None):
+        pendent = self.pendents.get((equip, prova_id))
+        if pendent is None:
+            return
+        if pendent["fila"] is None:
+            pendent["fila"] = fila
+        if row is not None:
+            pendent["row"] = row
+
+    def decidir(self, equip: str, prova_id: str, punts: int, estat: str):
+        """Aplica la revisió d'una resposta PENDENT sense rellegir la fulla."""
+        pendent = self.pendents.pop((equip, prova_id), None)
+        if pendent is None:
+            return
+        e = self.equips[equip]
+        e["estats"][prova_id] = estat
+        if estat == "VALIDADA":
+            e["punts"] += punts
+            e["correctes"] += 1
+            # compta l'hora de la resposta, no la de la revisió
+            e["darrera_correcta"] = _maxim(e["darrera_correcta"], _segons_hora(pendent["hora"]))
+        # la mateixa fila de la cache de records, perquè una reconstrucció no la desfaci
+        pendent["row"]["punts"] = punts
+        pendent["row"]["estat"] = estat
+        _nova_versio("records")
+
+    def equip(self, equip: str) -> dict:
+        return self.equips.get(equip) or _equip_buit()
+
+    def classificacio(self) -> list:
+        """[(equip, dades)] de primer a últim."""
+        return sorted(self.equips.items(), key=_clau_classificacio)
+
+    def durades_blocs(self, equip: str) -> list:
+        """Segons per fer cada bloc acabat (el primer, des de la primera resposta)."""
+        e = self.equip(equip)
+        durades, anterior = [], e["inici"]
+        for fi in e["fi_blocs"]:
+            durades.append(fi - anterior if fi is not None and anterior is not None else None)
+            anterior = fi
+        return durades
+
+# ----------------------------
+# Cua de respostes amb registre local (write-behind)
+# ----------------------------
+# Cada resposta s'escriu primer a un fitxer local només d'afegir (WAL) amb
+# fsync; en aquell moment ja es considera guardada. Una tasca de fons la
+# bolca a punts_equips en lots amb append_rows i, quan Sheets confirma,
+# escriu una marca "ack" al WAL. En arrencar es tornen a encuar les entrades
+# sense ack. Si el procés mor entre l'append i l'ack una fila es pot
+# duplicar (entrega com a mínim una vegada), mai perdre.
+_CAPCALERA_RECORDS = ["equip", "prova_id", "resposta", "punts", "estat", "hora"]
+# Un sol fil per al WAL: les escriptures queden ordenades i l'fsync no bloqueja el bucle
+_WAL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wal")
+
+class CuaSubmissions:
+    def __init__(self, path: str):
+        self.path = path
+        self.pendents: list = []   # entrades {"seq": int, "row": list} encara no bolcades
+        # clau d'idempotència -> (punts, estat) de les respostes encara no bolcades;
+        # un cop a la fulla, un missatge repetit ja l'atura ja_resposta
+        self.claus: Dict[str, tuple] = {}
+        self._seq = 0
+        self._despertar: Optional[asyncio.Event] = None
+
+    def carregar(self):
+        """Llegeix el WAL i recupera les entrades que no tenen ack."""
+        if not os.path.exists(self.path):
+            return
+        entrades = {}
+        with open(self.path, encoding="utf-8") as f:
+            for linia in f:
+                try:
+                    item = json.loads(linia)
+                except ValueError:
+                    # última línia tallada per una caiguda: no s'havia confirmat
+                    continue
+                if "ack" in item:
+                    for seq in item["ack"]:
+                        entrades.pop(seq, None)
+                else:
+                    entrades[item["seq"]] = item
+                    self._seq = max(self._seq, item["seq"])
+        self.pendents = sorted(entrades.values(), key=lambda e: e["seq"])
+        self.claus = {e["clau"]: (e["row"][3], e["row"][4]) for e in self.pendents if e.get("clau")}
+        if self.pendents:
+            print(f"♻️ Recuperades {len(self.pendents)} respostes pendents del WAL")
+
+    def _escriure(self, item: dict, compactar: bool = False):
+        if compactar:
+            # tot bolcat: comencem un WAL nou en lloc de créixer indefinidament
+            mode = "w"
+            item = None
+        else:
+            mode = "a"
+        with open(self.path, mode, encoding="utf-8") as f:
+            if item is not None:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _al_wal(self, item: Optional[dict], compactar: bool = False):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_WAL_EXECUTOR, self._escriure, item, compactar)
+
+    async def afegir(self, row: list, clau: Optional[str] = None):
+        """Guarda la fila al WAL (durable) i l'encua per bolcar-la a Sheets."""
+        self._seq += 1
+        entrada = {"seq": self._seq, "row": row}
+        if clau:
+            entrada["clau"] = clau
+        # a pendents abans d'escriure: un bolcat que acabi mentrestant no ha de
+        # compactar (truncar) el WAL amb aquesta entrada encara en camí
+        self.pendents.append(entrada)
+        try:
+            await self._al_wal(entrada)
+        except BaseException:
+            self.pendents = [e for e in self.pendents if e is not entrada]
+            raise
+        if clau:
+            self.claus[clau] = (row[3], row[4])
+        if self._despertar is not None and len(self.pendents) >= FLUSH_BATCH:
+            self._despertar.set()
+
+    def resultat(self, clau: str) -> Optional[tuple]:
+        """(punts, estat) si el missatge amb aquesta clau ja s'ha registrat."""
+        return self.claus.get(clau)
+
+    def files_pendents(self) -> list:
+        return [dict(zip(_CAPCALERA_RECORDS, e["row"])) for e in self.pendents]
+
+    async def bolcar(self) -> int:
+        """Envia un lot de pendents amb un sol append_rows. Retorna les files enviades."""
+        lot = self.pendents[:FLUSH_BATCH]
+        if not lot:
+            return 0
+        files = [e["row"] for e in lot]
+        numeros = await _en_executor_escriptura(lambda: _magatzem().afegir_records(files))
+        if numeros:
+            index = esdeveniment().respostes
+            for row, fila in zip(files, numeros):
+                index.assignar_fila(row[0], str(row[1]), fila)
+        enviades = {e["seq"] for e in lot}
+        self.pendents = [e for e in self.pendents if e["seq"] not in enviades]
+        for e in lot:
+            if e.get("clau"):
+                self.claus.pop(e["clau"], None)
+        # Les files ja són a la fulla i a l'índex: la propera lectura de records
+        # (en segon pla, sense fer esperar cap resposta) les inclourà
+        cache_caducar("records")
+        await self._al_wal({"ack": sorted(enviades)}, compactar=not self.pendents)
+        return len(lot)
+
+    async def bucle(self):
+        """Tasca de fons: bolca periòdicament amb reintents i espera exponencial."""
+        self._despertar = asyncio.Event()
+        espera_error = FLUSH_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                while await self.bolcar():
+                    pass
+                espera_error = FLUSH_INTERVAL
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metriques.error("bolcat_respostes")
+                print(f"⚠️ Error bolcant respostes a Sheets ({len(self.pendents)} pendents): {e}")
+                await asyncio.sleep(espera_error)
+                espera_error = min(espera_error * 2, 60)
+
+metriques.cua("respostes_per_bolcar", lambda: sum(len(e.cua.pendents) for e in _ESDEVENIMENTS.values()))
+metriques.cua("executor_sheets", lambda: _SHEETS_EXECUTOR._work_queue.qsize())
+metriques.cua("executor_sheets_escriptura", lambda: _SHEETS_EXECUTOR_ESCRIPTURA._work_queue.qsize())
+metriques.cua("carregues_cache_en_vol", lambda: sum(len(e.cache_carregant) for e in _ESDEVENIMENTS.values()))
+
+# ----------------------------
+# Diari d'operacions (JSONL)
+# ----------------------------
+# Cada update rebut i cada canvi d'estat (inscripcions, respostes, usuaris i
+# decisions de l'organització) queda com una línia JSON compacta. El camí
+# calent només afegeix un dict a un buffer en memòria; una tasca de fons el
+# serialitza i l'escriu en un fil propi, i rota el fitxer quan passa de
+# DIARI_MIDA_MAX (diari.jsonl.1 és el més recent dels rotats). No fa fsync:
+# la durabilitat de les respostes és cosa del WAL; el diari serveix per
+# reconstruir l'estat i reproduir una jornada amb replay_ginkana.py.
+_DIARI_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diari")
+
+class Diari:
+    def __init__(self, path: str, mida_max: int, fitxers: int, interval: float, buffer_max: int):
+        self.path = path
+        self.mida_max = mida_max
+        self.fitxers = fitxers
+        self.interval = interval
+        self.buffer_max = buffer_max
+        self._buffer: list = []
+        self._despertar: Optional[asyncio.Event] = None
+
+    def registrar(self, tipus: str, ginkana: Optional[str] = None, **dades):
+        if not self.path:
+            return
+        if len(self._buffer) >= self.buffer_max:
+            # el disc no dona l'abast: perdem entrades del diari, mai l'update
+            metriques.error("diari_descartat")
+            return
+        entrada = {"t": round(time.time(), 3), "tipus": tipus, "ginkana": ginkana or esdeveniment().nom}
+        entrada.update(dades)
+        self._buffer.append(entrada)
+        if self._despertar is not None and len(self._buffer) >= self.buffer_max // 2:
+            # no esperem l'interval: que no s'arribi a omplir
+            self._despertar.set()
+
+    def _escriure(self, entrades: list):
+        text = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in entrades)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(text)
+            mida = f.tell()
+        if mida >= self.mida_max:
+            self._rotar()
+
+    def _rotar(self):
+        for i in range(self.fitxers - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def bolcar(self) -> int:
+        """Escriu el que hi ha al buffer. Retorna les entrades escrites."""
+        if not self._buffer:
+            return 0
+        lot, self._buffer = self._buffer, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(_DIARI_EXECUTOR, self._escriure, lot)
+        except OSError as e:
+            # les tornem al davant del buffer per reintentar-ho a la propera passada
+            metriques.error("diari")
+            print(f"⚠️ Error escrivint el diari ({len(lot)} entrades): {e}")
+            self._buffer[:0] = lot[-self.buffer_max:]
+            return 0
+        return len(lot)
+
+    async def bucle(self):
+        self._despertar = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            await self.bolcar()
+
+diari = Diari(DIARI_PATH, DIARI_MIDA_MAX, DIARI_FITXERS, DIARI_INTERVAL, DIARI_BUFFER_MAX)
+metriques.cua("diari_per_escriure", lambda: len(diari._buffer))
+
+async def registrar_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler del grup -1: apunta cada update al diari abans de processar-lo."""
+    missatge = update.effective_message
+    usuari = update.effective_user
+    chat = update.effective_chat
+    diari.registrar(
+        "update",
+        ginkana=esdeveniment_del_xat(chat.id if chat else None).nom,
+        update_id=update.update_id,
+        xat=chat.id if chat else None,
+        usuari=usuari.id if usuari else None,
+        username=usuari.username if usuari else None,
+        nom=usuari.first_name if usuari else None,
+        msg=missatge.message_id if missatge else None,
+        text=missatge.text if missatge else None,
+    )
 
 # ----------------------------
 # Funcions de guardat (i invalidació de cache)
 # ----------------------------
-def guardar_equip(equip, portaveu, jugadors_llista):
+async def guardar_equip(equip, portaveu, jugadors_llista):
     hora = datetime.datetime.now(MADRID_TZ).strftime("%H:%M")
-    # append a sheet_equips
-    sheet_equips.append_row([equip, portaveu.lstrip("@"), ",".join(jugadors_llista), hora])
-    # invalidar cache d'equips (i usuaris no cal)
-    cache_invalidate("equips")
-
-def guardar_submission(equip, prova_id, resposta, punts, estat):
+    index = await index_equips()
+    # el registrem abans d'escriure perquè una inscripció concurrent ja el vegi
+    index.afegir(equip, portaveu, jugadors_llista, hora)
+    cache_actualitzat("equips")
+    row = [equip, portaveu.lstrip("@"), ",".join(jugadors_llista), hora]
+    try:
+        await _en_executor_escriptura(lambda: _magatzem().afegir_equip(row))
+    except Exception:
+        index.treure(equip)
+        raise
+    # Una lectura feta mentre escrivíem pot haver desat un índex sense la fila:
+    # l'hi afegim, i les que encara són en vol ja no es desaran.
+    cache_actualitzat("equips")
+    actual = esdeveniment().cache.get("equips")
+    if actual is not None and actual[0] is not index and equip not in actual[0].equips:
+        actual[0].afegir(equip, portaveu, jugadors_llista, hora)
+    diari.registrar("equip", equip=equip, portaveu=row[1], jugadors=row[2], hora=hora)
+
+def pany_equip(equip: str) -> asyncio.Lock:
+    """Lock per equip: serialitza les respostes d'un equip encara que arribin per
+    dos usuaris diferents (el portaveu es reconeix per username o per nom)."""
+    return esdeveniment().panys_equips.setdefault(equip, asyncio.Lock())
+
+async def guardar_submission(equip, prova_id, resposta, punts, estat, clau=None):
     hora_local = datetime.datetime.now(MADRID_TZ).strftime("%H:%M:%S")
-    sheet_records.append_row([equip, prova_id, resposta, punts, estat, f"=\"{hora_local}\""])
-    # invalidar la cache de records
-    cache_invalidate("records")
-
-def ja_resposta(equip, prova_id):
-    records = get_records()
-    return any(row["equip"] == equip and str(row["prova_id"]) == str(prova_id) for row in records)
-
-def respostes_equip(equip):
-    res = {}
-    for row in get_records():
-        if row["equip"] == equip:
-            res[str(row["prova_id"])] = row["estat"]
-    return res
-
-def bloc_actual(equip, proves):
-    res = respostes_equip(equip)
-    if all(str(i) in res for i in range(1, 11)):
-        if all(str(i) in res for i in range(11, 21)):
-            if all(str(i) in res for i in range(21, 30)):
-                return 4  # Bloc final amb pregunta secreta i final_joc
-            return 3
-        return 2
-    return 1
+    # confirmada quan és al WAL; la tasca de fons la bolcarà a punts_equips
+    row = [equip, prova_id, resposta, punts, estat, hora_local]
+    e = esdeveniment()
+    await e.cua.afegir(row, clau)
+    e.respostes.registrar(dict(zip(_CAPCALERA_RECORDS, row)))
+    diari.registrar("resposta", equip=equip, prova=prova_id, resposta=resposta, punts=punts,
+                    estat=estat, hora=hora_local, clau=clau)
+
+async def ja_resposta(equip, prova_id):
+    index = await index_respostes()
+    return str(prova_id) in index.equip(equip)["estats"]
+
+async def respostes_equip(equip):
+    """prova_id -> estat de l'equip (vista de l'índex, no s'ha de modificar)."""
+    index = await index_respostes()
+    return index.equip(equip)["estats"]
+
+async def bloc_actual(equip, proves):
+    index = await index_respostes()
+    return index.equip(equip)["bloc"]
 
 def validate_answer(prova, resposta):
     tipus = prova["tipus"]
@@ -201,27 +1687,258 @@ def validate_answer(prova, resposta):
     if correct_answer == "REVIEW_REQUIRED":
         return 0, "PENDENT"
     if tipus in ["trivia", "qr", "final_joc", "pregunta_secreta"]:
-        possibles = [r.strip().lower() for r in correct_answer.split("|")]
-        if str(resposta).strip().lower() in possibles:
+        if matcher_de(prova).encaixa(resposta):
             return punts, "VALIDADA"
         else:
             return 0, "INCORRECTA"
     return 0, "PENDENT"
 
-def guardar_chat_id(username, chat_id):
+async def guardar_chat_id(username, chat_id):
     username = username.lower()
-    # fem una lectura de la fulla usuaris (cache)
-    rows = sheet_usuaris.get_all_records()
-    exists = any(int(r["chat_id"]) == chat_id for r in rows)
-    if not exists:
-        sheet_usuaris.append_row([username, chat_id])
-        # invalidem cache d'usuaris perquè hi ha nou usuari
-        cache_invalidate("usuaris")
+    index = await index_usuaris()
+    if chat_id in index.chat_ids:
+        return
+    index.afegir(username, chat_id)
+    cache_actualitzat("usuaris")
+    try:
+        await _en_executor_escriptura(lambda: _magatzem().afegir_usuari([username, chat_id]))
+    except Exception:
+        index.chat_ids.discard(chat_id)
+        index.per_username.pop(username, None)
+        raise
+    # com a guardar_equip: que una lectura feta durant l'escriptura no el perdi
+    cache_actualitzat("usuaris")
+    actual = esdeveniment().cache.get("usuaris")
+    if actual is not None and actual[0] is not index and chat_id not in actual[0].chat_ids:
+        actual[0].afegir(username, chat_id)
+    diari.registrar("usuari", username=username, chat=chat_id)
+
+# ----------------------------
+# Snapshot a disc (arrencada en calent)
+# ----------------------------
+# Cada SNAPSHOT_INTERVAL segons desem les dades cachejades i els índexs en un
+# JSON compacte. En arrencar, si n'hi ha un del mateix document, el carreguem
+# amb les entrades ja caducades: el bot respon de seguida amb aquestes dades
+# (stale-while-revalidate) mentre obre les fulles i es reconcilia en segon pla.
+# Cada ginkana té el seu fitxer (Esdeveniment.path_snapshot).
+_SNAPSHOT_FORMAT = 2
+
+def _font_dades() -> str:
+    e = esdeveniment()
+    if GINKANA_BACKEND == "sqlite":
+        return f"sqlite:{os.path.abspath(e.path_sqlite)}"
+    return f"sheets:{e.document}"
+
+def crear_snapshot() -> dict:
+    e = esdeveniment()
+    cache = e.cache
+    dades = {"format": _SNAPSHOT_FORMAT, "font": _font_dades(), "hora": _now().isoformat()}
+    if "proves" in cache:
+        dades["proves"] = cache["proves"][0]
+    if "equips" in cache:
+        dades["equips"] = [[equip, info["portaveu"], info["jugadors"], info["hora_inscripcio"]]
+                           for equip, info in cache["equips"][0].equips.items()]
+    if "usuaris" in cache:
+        index = cache["usuaris"][0]
+        per_chat = {chat_id: username for username, chat_id in index.per_username.items()}
+        dades["usuaris"] = [[per_chat.get(c, ""), c] for c in index.chat_ids]
+    for nom in ("ajuda", "emergencia"):
+        if nom in cache:
+            dades[nom] = cache[nom][0]
+    llista = e.sync_records["llista"]
+    if llista is not None:
+        dades["records"] = llista
+        if e.respostes.origen is llista.lectura:
+            dades["index_respostes"] = {"equips": e.respostes.equips, "n_origen": e.respostes.n_origen}
+    return dades
+
+def carregar_snapshot(path: str = None) -> bool:
+    """Omple la cache des del snapshot. Retorna False si no n'hi ha cap d'aprofitable."""
+    e = esdeveniment()
+    path = path or e.path_snapshot
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, encoding="utf-8") as f:
+            dades = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Snapshot il·legible, arrencada en fred: {e}")
+        return False
+    if dades.get("format") != _SNAPSHOT_FORMAT or dades.get("font") != _font_dades():
+        return False
+    # caducades des del primer moment: es serveixen i es refresquen en segon pla
+    caducat = _now() - datetime.timedelta(days=1)
+    cache = e.cache
+    if "proves" in dades:
+        cache["proves"] = (dades["proves"], caducat, _CACHE_TTLS["proves"])
+        compilar_matchers(dades["proves"])
+        _nova_versio("proves")
+    if "equips" in dades:
+        index = IndexEquips()
+        for equip, portaveu, jugadors, hora in dades["equips"]:
+            index.afegir(equip, portaveu, jugadors, hora)
+        cache["equips"] = (index, caducat, _CACHE_TTLS["equips"])
+    if "usuaris" in dades:
+        index = IndexUsuaris()
+        for username, chat_id in dades["usuaris"]:
+            index.afegir(username, chat_id)
+        cache["usuaris"] = (index, caducat, _CACHE_TTLS["usuaris"])
+    for nom in ("ajuda", "emergencia"):
+        if nom in dades:
+            cache[nom] = (dades[nom], caducat, _CACHE_TTLS[nom])
+    if "records" in dades:
+        records = LlistaRecords(dades["records"])
+        e.sync_records["llista"] = records
+        # la primera càrrega serà completa per recollir el que hagi canviat mentre estàvem aturats
+        e.sync_records["reconciliat"] = 0.0
+        cache["records"] = (records, caducat, _CACHE_TTLS["records"])
+        if "index_respostes" in dades:
+            e.respostes.equips = dades["index_respostes"]["equips"]
+            e.respostes.origen = records.lectura
+            e.respostes.n_origen = dades["index_respostes"]["n_origen"]
+            _nova_versio("records")
+    print(f"♻️ Snapshot de {e.nom} del {dades['hora']} carregat")
+    return True
+
+def _escriure_snapshot(text: str, path: str):
+    temporal = path + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(text)
+    # substitució atòmica: mai deixem un snapshot a mig escriure
+    os.replace(temporal, path)
+
+async def desar_snapshot():
+    # es serialitza al bucle (les dades no canvien a mig dump) i s'escriu en un fil
+    text = json.dumps(crear_snapshot(), ensure_ascii=False, separators=(",", ":"))
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_WAL_EXECUTOR, _escriure_snapshot, text, esdeveniment().path_snapshot)
+
+async def bucle_snapshot():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await desar_snapshot()
+        except Exception as e:
+            print(f"⚠️ No s'ha pogut desar el snapshot: {e}")
+
+# ----------------------------
+# Missatges renderitzats (cache per versió i paginació)
+# ----------------------------
+TELEGRAM_MAX_MISSATGE = 4096
+# Per ginkana, Esdeveniment.renders: (vista, clau) -> (versió de les dades,
+# pàgines), en ordre d'ús i com a molt GINKANA_RENDERS_MAX entrades.
+
+def _paginar(text: str, limit: int = TELEGRAM_MAX_MISSATGE) -> list:
+    """Parteix el text en pàgines de com a molt `limit` caràcters, per línies."""
+    pagines, actual = [], ""
+    for linia in text.splitlines(keepends=True):
+        while len(linia) > limit:
+            # una sola línia massa llarga: la tallem en sec
+            if actual:
+                pagines.append(actual)
+                actual = ""
+            pagines.append(linia[:limit])
+            linia = linia[limit:]
+        if len(actual) + len(linia) > limit:
+            pagines.append(actual)
+            actual = ""
+        actual += linia
+    if actual.strip() or not pagines:
+        pagines.append(actual)
+    return pagines
+
+def _renderitzat(vista: str, clau: str, versio: tuple, render: Callable[[], str]) -> list:
+    renders = esdeveniment().renders
+    entrada = renders.get((vista, clau))
+    if entrada and entrada[0] == versio:
+        renders.move_to_end((vista, clau))
+        return entrada[1]
+    pagines = _paginar(render())
+    renders[(vista, clau)] = (versio, pagines)
+    renders.move_to_end((vista, clau))
+    while len(renders) > GINKANA_RENDERS_MAX:
+        renders.popitem(last=False)
+    return pagines
+
+async def _respondre_pagines(update: Update, pagines: list):
+    for pagina in pagines:
+        await update.message.reply_text(pagina)
+
+def _render_ranking(index: "IndexRespostes") -> str:
+    # Punts i, en cas d'empat, qui ha acabat abans (vegeu _clau_classificacio)
+    linies = ["🏆 Classificació:\n\n"]
+    for i, (equip, data) in enumerate(index.classificacio(), start=1):
+        base = f"{i}. {equip} - {data['punts']} punts ({data['correctes']}/{data['contestades']} ✅)"
+
+        # Mostrar hora final del bloc 3 si l’equip ha completat el bloc 3
+        fi30 = data["fi_blocs"][2]
+        if fi30 is not None and esdeveniment().mostrar_fi30:
+            base += f" | Fi 30 proves {_format_segons(fi30)}⏰"
+        linies.append(base + "\n")
+    return "".join(linies)
+
+def exportar_resultats(index: "IndexRespostes") -> str:
+    """Classificació final en CSV, amb la línia de temps de cada equip."""
+    sortida = io.StringIO()
+    writer = csv.writer(sortida)
+    writer.writerow(["posicio", "equip", "punts", "correctes", "contestades", "bloc",
+                     "inici", "fi_bloc1", "fi_bloc2", "fi_bloc3",
+                     "durada_bloc1", "durada_bloc2", "durada_bloc3", "darrera_correcta"])
+    for i, (equip, data) in enumerate(index.classificacio(), start=1):
+        writer.writerow([i, equip, data["punts"], data["correctes"], data["contestades"], data["bloc"],
+                         _format_segons(data["inici"]),
+                         *(_format_segons(fi) for fi in data["fi_blocs"]),
+                         *(_format_segons(d) for d in index.durades_blocs(equip)),
+                         _format_segons(data["darrera_correcta"])])
+    return sortida.getvalue()
+
+def _render_ekips(equips: dict, index: "IndexRespostes") -> str:
+    equips_list = []
+    for equip, info in equips.items():
+        equips_list.append({
+            "equip": equip,
+            "portaveu": info["portaveu"],
+            "jugadors": ", ".join(info["jugadors"]),
+            "hora": info.get("hora_inscripcio", ""),
+            "punts": index.equip(equip)["punts"]
+        })
+    equips_list.sort(key=lambda x: x["hora"])
+    linies = ["📋 Llista d'equips:\n\n"]
+    for e in equips_list:
+        linies.append(f"{e['equip']} | @{e['portaveu']} | Jugadors: {e['jugadors']} | Hora insc: {e['hora']} | Punts: {e['punts']}\n")
+    return "".join(linies)
+
+_RANGS_BLOCS = {
+    1: range(1,11),
+    2: range(11,21),
+    3: range(21,31),
+    4: range(31,33)
+}
+
+def _render_proves(bloc: int, res: dict, proves: dict) -> str:
+    capcalera = f"📋 Llista de proves pendents (bloc {bloc}):\n\n"
+    linies = [capcalera]
+    for pid in _RANGS_BLOCS[bloc]:
+        if str(pid) in proves and str(pid) not in res:
+            p = proves[str(pid)]
+            linies.append(f"{pid}. {p['titol']}\n{p['descripcio']} - {p['punts']} punts\n\n")
+
+    # Missatges especials
+    if bloc == 4 and all(str(i) in res for i in range(21,31)) and "31" not in res:
+        linies.append("🔐 Pregunta secreta disponible! 🤫")
+    elif bloc == 4 and "32" not in res:
+        linies.append("🏁 Prova final de joc disponible!")
+    elif len(linies) == 1:
+        linies.append("🎉 Totes les proves del bloc actual han estat contestades!")
+    return "".join(linies)
 
 # ----------------------------
 # Comandes Telegram
 # ----------------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # enllaç directe t.me/<bot>?start=<nom>: el xat queda associat a aquesta ginkana
+    if context.args:
+        await triar_esdeveniment(update.effective_chat.id, context.args[0])
     await update.message.reply_text(
         "👋 Benvingut a la Gran Ginkana de la Fira del Raure 2025 de Ginestar!\n\n"
         "La Ginkana ha començat a les 11h i acaba a les 19h. \n"
@@ -237,12 +1954,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = carregar_ajuda()
+    msg = await carregar_ajuda()
     await update.message.reply_text(msg)
 
 async def inscriure(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
-    guardar_chat_id((user.username or user.first_name).lower(), user.id)
+    # el chat_id només serveix per a avisos posteriors: la resposta no l'espera
+    escriure_en_segon_pla(guardar_chat_id((user.username or user.first_name).lower(), user.id))
     if len(context.args) < 2:
         await update.message.reply_text("Format: /inscriure NomEquip nom1,nom2,...")
         return
@@ -253,102 +1971,37 @@ async def inscriure(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Cal indicar almenys un jugador.")
         return
     portaveu = (user.username or user.first_name).lower()
-    equips = carregar_equips()
-    for info in equips.values():
-        if info["portaveu"] == portaveu:
-            await update.message.reply_text("❌ Ja ets portaveu d'un altre equip.")
-            return
-    guardar_equip(equip, portaveu, jugadors_llista)
+    index = await index_equips()
+    if portaveu in index.per_portaveu:
+        await update.message.reply_text("❌ Ja ets portaveu d'un altre equip.")
+        return
+    if equip.lower() in index.noms:
+        await update.message.reply_text(f"❌ Ja hi ha un equip inscrit amb el nom '{equip}'.")
+        return
+    await guardar_equip(equip, portaveu, jugadors_llista)
     await update.message.reply_text(f"✅ Equip '{equip}' registrat amb portaveu @{portaveu}.")
 
 async def llistar_proves(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    proves = carregar_proves()
-    user = update.message.from_user
-    username = (user.username or "").lstrip("@").lower()
-    firstname = (user.first_name or "").lower()
-    equips = carregar_equips()
-    equip = None
-    for e, info in equips.items():
-        if info["portaveu"] in [username, firstname]:
-            equip = e
-            break
+    proves = await carregar_proves()
+    equip = await _obtenir_equip_portaveu(update.message.from_user)
     if not equip:
         await update.message.reply_text("❌ Has d'estar inscrit per veure les proves.")
         return
-    bloc = bloc_actual(equip, proves)
-    res = respostes_equip(equip)
-
-    rangs_blocs = {
-        1: range(1,11),
-        2: range(11,21),
-        3: range(21,31),
-        4: range(31,33)
-    }
-    rang = rangs_blocs[bloc]
-
-    msg = f"📋 Llista de proves pendents (bloc {bloc}):\n\n"
-    for pid in rang:
-        if str(pid) in proves and str(pid) not in res:
-            p = proves[str(pid)]
-            msg += f"{pid}. {p['titol']}\n{p['descripcio']} - {p['punts']} punts\n\n"
-
-    # Missatges especials
-    if bloc == 4 and all(str(i) in res for i in range(21,31)) and "31" not in res:
-        msg += "🔐 Pregunta secreta disponible! 🤫"
-    elif bloc == 4 and "32" not in res:
-        msg += "🏁 Prova final de joc disponible!"
-    elif msg.strip() == f"📋 Llista de proves pendents (bloc {bloc}):":
-        msg += "🎉 Totes les proves del bloc actual han estat contestades!"
-
-    await update.message.reply_text(msg)
+    bloc = await bloc_actual(equip, proves)
+    res = await respostes_equip(equip)
+    versio = (_versio("proves"), _versio("records"))
+    pagines = _renderitzat("proves", equip, versio, lambda: _render_proves(bloc, res, proves))
+    await _respondre_pagines(update, pagines)
 
 async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        records = get_records()
-        if not records:
+        index = await index_respostes()
+        if not index.equips:
             await update.message.reply_text("⚠️ No hi ha punts registrats encara.")
             return
-
-        equips_data = {}
-        for row in records:
-            e = row["equip"]
-            equips_data.setdefault(e, {
-                "punts": 0,
-                "contestades": 0,
-                "correctes": 0,
-                "respostes": {}
-            })
-            equips_data[e]["contestades"] += 1
-            equips_data[e]["respostes"][str(row["prova_id"])] = row.get("hora")
-            if row["estat"] == "VALIDADA":
-                equips_data[e]["punts"] += int(row["punts"])
-                equips_data[e]["correctes"] += 1
-
-        if not equips_data:
-            await update.message.reply_text("⚠️ No hi ha punts registrats encara.")
-            return
-
-        # Ordenar equips per punts
-        sorted_equips = sorted(
-            equips_data.items(),
-            key=lambda x: x[1]["punts"],
-            reverse=True
-        )
-
-        msg = "🏆 Classificació:\n\n"
-        for i, (equip, data) in enumerate(sorted_equips, start=1):
-            base = f"{i}. {equip} - {data['punts']} punts ({data['correctes']}/{data['contestades']} ✅)"
-
-            # Mostrar hora final del bloc 3 si l’equip ha completat el bloc 3
-            bloc3_complet = all(str(pid) in data["respostes"] for pid in range(21, 31))
-            if bloc3_complet and MOSTRAR_FI30:
-                hores_bloc3 = [data["respostes"][str(pid)] for pid in range(21, 31) if data["respostes"].get(str(pid))]
-                if hores_bloc3:
-                    hora_fi_bloc3 = max(hores_bloc3)
-                    base += f" | Fi 30 proves {hora_fi_bloc3}⏰"
-            msg += base + "\n"
-
-        await update.message.reply_text(msg)
+        versio = (_versio("records"), esdeveniment().mostrar_fi30)
+        pagines = _renderitzat("ranking", "", versio, lambda: _render_ranking(index))
+        await _respondre_pagines(update, pagines)
 
     except Exception as e:
         await update.message.reply_text("❌ Ha ocorregut un error generant el ranking.")
@@ -356,27 +2009,11 @@ async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def ekips(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    equips = carregar_equips()
-    records = get_records()
-    equips_list = []
-    for equip, info in equips.items():
-        punts = sum(
-            int(row["punts"])
-            for row in records
-            if row["equip"] == equip and row["estat"] == "VALIDADA"
-        )
-        equips_list.append({
-            "equip": equip,
-            "portaveu": info["portaveu"],
-            "jugadors": ", ".join(info["jugadors"]),
-            "hora": info.get("hora_inscripcio", ""),
-            "punts": punts
-        })
-    equips_list.sort(key=lambda x: x["hora"])
-    msg = "📋 Llista d'equips:\n\n"
-    for e in equips_list:
-        msg += f"{e['equip']} | @{e['portaveu']} | Jugadors: {e['jugadors']} | Hora insc: {e['hora']} | Punts: {e['punts']}\n"
-    await update.message.reply_text(msg)
+    equips = await carregar_equips()
+    index = await index_respostes()
+    versio = (_versio("equips"), _versio("records"))
+    pagines = _renderitzat("ekips", "", versio, lambda: _render_ekips(equips, index))
+    await _respondre_pagines(update, pagines)
 
 async def resposta_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
@@ -390,53 +2027,62 @@ async def resposta_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     prova_id, resposta = parts[1], parts[2]
-    proves = carregar_proves()
+    proves = await carregar_proves()
     if prova_id not in proves:
         await update.message.reply_text("❌ Prova no trobada.")
         return
 
     # --- Identificar equip ---
-    equip = _obtenir_equip_portaveu(update.message.from_user)
+    equip = await _obtenir_equip_portaveu(update.message.from_user)
     if not equip:
         await update.message.reply_text("❌ Només el portaveu pot enviar respostes.")
         return
 
-    if ja_resposta(equip, prova_id):
-        await update.message.reply_text(f"⚠️ L'equip '{equip}' ja ha respost la prova {prova_id}.")
-        return
+    # Una resposta de l'equip cada vegada: la comprovació de ja_resposta, el
+    # registre i el càlcul del bloc no es poden intercalar amb una altra.
+    clau = f"{update.message.chat_id}:{update.message.message_id}"
+    prova = proves[prova_id]
+    async with pany_equip(equip):
+        previ = esdeveniment().cua.resultat(clau)
+        if previ is not None:
+            # el mateix missatge tornat a lliurar: responem igual sense puntuar-lo de nou
+            punts, estat = previ
+            icon = {"VALIDADA": "✅","INCORRECTA": "❌","PENDENT": "⏳"}.get(estat, "ℹ️")
+            await update.message.reply_text(f"{icon} Resposta registrada: {estat}. Punts: {punts}")
+            return
 
-    # --- Estat abans ---
-    bloc_anterior = bloc_actual(equip, proves)
+        if await ja_resposta(equip, prova_id):
+            await update.message.reply_text(f"⚠️ L'equip '{equip}' ja ha respost la prova {prova_id}.")
+            return
 
-    # --- Processar resposta ---
-    prova = proves[prova_id]
-    punts, estat = _processar_resposta(equip, prova_id, resposta, prova)
+        # --- Estat abans ---
+        bloc_anterior = await bloc_actual(equip, proves)
+
+        # --- Processar resposta ---
+        punts, estat = await _processar_resposta(equip, prova_id, resposta, prova, clau)
+
+        # --- Estat després ---
+        bloc_nou = await bloc_actual(equip, proves)
+        respostes = dict(await respostes_equip(equip))
 
     icon = {"VALIDADA": "✅","INCORRECTA": "❌","PENDENT": "⏳"}.get(estat, "ℹ️")
     await update.message.reply_text(f"{icon} Resposta registrada: {estat}. Punts: {punts}")
 
-    # --- Estat després ---
-    bloc_nou = bloc_actual(equip, proves)
-    respostes = respostes_equip(equip)
-
     await _gestionar_canvis_bloc(update, context, bloc_anterior, bloc_nou)
     await _gestionar_pregunta_secreta(update, respostes)
     await _gestionar_final_joc(update, prova, estat)
 
 
-def _obtenir_equip_portaveu(user) -> Optional[str]:
+async def _obtenir_equip_portaveu(user) -> Optional[str]:
     username = (user.username or "").lstrip("@").lower()
     firstname = (user.first_name or "").lower()
-    equips = carregar_equips()
-    for e, info in equips.items():
-        if info["portaveu"] in [username, firstname]:
-            return e
-    return None
+    index = await index_equips()
+    return index.equip_de(username, firstname)
 
 
-def _processar_resposta(equip: str, prova_id: str, resposta: str, prova: dict):
+async def _processar_resposta(equip: str, prova_id: str, resposta: str, prova: dict, clau: str = None):
     punts, estat = validate_answer(prova, resposta)
-    guardar_submission(equip, prova_id, resposta, punts, estat)
+    await guardar_submission(equip, prova_id, resposta, punts, estat, clau)
     return punts, estat
 
 
@@ -473,56 +2119,731 @@ async def _gestionar_final_joc(update, prova: dict, estat: str):
 # ----------------------------
 # Emergència
 # ----------------------------
+class Difusio:
+    """Envia un missatge a molts xats amb concurrència acotada i límit global.
+
+    Cada entrega es registra a DIFUSIO_LOG (JSON per línia). Si una difusió
+    s'interromp, en tornar a llançar el mateix text es reprèn saltant els
+    xats que ja el tenen. El registre s'escriu per lots fora del bucle: si
+    ens aturem de cop, com a molt un lot de xats rebrà el missatge dues vegades.
+    """
+
+    def __init__(self, path_log: str, concurrencia: int, bucket: TokenBucket, reintents: int):
+        self.path_log = path_log
+        self.concurrencia = concurrencia
+        self.bucket = bucket
+        self.reintents = reintents
+        self._lot_log: list = []
+
+    def _reprendre(self, hash_text: str) -> Tuple[str, set]:
+        """Retorna l'id de la difusió inacabada d'aquest text i els xats ja servits."""
+        difusions: Dict[str, dict] = {}
+        if os.path.exists(self.path_log):
+            with open(self.path_log, encoding="utf-8") as f:
+                for linia in f:
+                    try:
+                        item = json.loads(linia)
+                    except ValueError:
+                        continue
+                    d = difusions.setdefault(item["id"], {"hash": None, "fi": False, "enviats": set()})
+                    if "hash" in item:
+                        d["hash"] = item["hash"]
+                    if item.get("fi"):
+                        d["fi"] = True
+                    if "chat_id" in item:
+                        d["enviats"].add(item["chat_id"])
+        for id_difusio, d in difusions.items():
+            if d["hash"] == hash_text and not d["fi"]:
+                return id_difusio, d["enviats"]
+        return _now().strftime("%Y%m%d%H%M%S%f"), set()
+
+    def _escriure_log(self, lot: list):
+        with open(self.path_log, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(item) + "\n" for item in lot))
+
+    async def _registrar(self, item: dict, bolcar: bool = False):
+        self._lot_log.append(item)
+        if bolcar or len(self._lot_log) >= self.concurrencia:
+            lot, self._lot_log = self._lot_log, []
+            # un sol fil: els lots arriben al fitxer en ordre
+            await asyncio.get_running_loop().run_in_executor(_WAL_EXECUTOR, self._escriure_log, lot)
+
+    async def enviar_a(self, bot, chat_id: int, text: str) -> bool:
+        """Envia un sol missatge amb el mateix límit i reintents que la difusió.
+        Retorna si ha arribat; els errors ja queden registrats."""
+        espera = 1.0
+        for intent in range(self.reintents + 1):
+            await self.bucket.esperar()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                # límit de Telegram: frenem tota la difusió, no només aquest xat
+                self.bucket.pausar(float(e.retry_after))
+            except (Forbidden, BadRequest) as e:
+                # bot bloquejat o xat inexistent: no té sentit reintentar
+                metriques.error("difusio")
+                print(f"❌ No s'ha pogut enviar a {chat_id}: {e}")
+                return False
+            except (TimedOut, NetworkError) as e:
+                if intent == self.reintents:
+                    metriques.error("difusio")
+                    print(f"❌ No s'ha pogut enviar a {chat_id}: {e}")
+                    return False
+                await asyncio.sleep(espera + random.uniform(0, espera))
+                espera = min(espera * 2, 30)
+        return False
+
+    async def enviar(self, bot, chat_ids: list, text: str,
+                     progres: Optional[Callable[[int, int, int], Any]] = None) -> Tuple[int, int, int]:
+        """Retorna (enviats, fallits, ja_enviats_abans)."""
+        hash_text = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        loop = asyncio.get_running_loop()
+        id_difusio, ja_enviats = await loop.run_in_executor(_WAL_EXECUTOR, self._reprendre, hash_text)
+        if not ja_enviats:
+            await self._registrar({"id": id_difusio, "hash": hash_text, "total": len(chat_ids)}, bolcar=True)
+        pendents = [c for c in chat_ids if c not in ja_enviats]
+        comptador = {"enviats": 0, "fallits": 0}
+        semafor = asyncio.Semaphore(self.concurrencia)
+
+        async def una(chat_id):
+            async with semafor:
+                if await self.enviar_a(bot, chat_id, text):
+                    await self._registrar({"id": id_difusio, "chat_id": chat_id})
+                    comptador["enviats"] += 1
+                else:
+                    comptador["fallits"] += 1
+                if progres:
+                    await progres(comptador["enviats"] + len(ja_enviats), comptador["fallits"], len(chat_ids))
+
+        await asyncio.gather(*(una(c) for c in pendents))
+        await self._registrar({"id": id_difusio, "fi": True}, bolcar=True)
+        return comptador["enviats"], comptador["fallits"], len(ja_enviats)
+
+# Límit global de missatges del bot, compartit per totes les difusions i ginkanes
+_BUCKET_TELEGRAM = TokenBucket(DIFUSIO_MISSATGES_SEGON)
+
 async def emergencia(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    missatge = carregar_emergencia()
-    chat_ids = carregar_chat_ids()
+    if not es_admin(update.message.from_user):
+        await update.message.reply_text("❌ Comanda només per a l'organització.")
+        return
+    missatge = await carregar_emergencia()
+    chat_ids = await carregar_chat_ids()
     if not chat_ids:
         await update.message.reply_text("⚠️ No hi ha cap usuari registrat per enviar el missatge d'emergència.")
         return
-    enviats = 0
-    for chat_id in chat_ids:
+    avis = await update.message.reply_text(f"📢 Enviant missatge d'emergència a {len(chat_ids)} usuaris...")
+    darrera_edicio = [time.monotonic()]
+
+    async def progres(enviats, fallits, total):
+        # com a molt una edició cada 2 s perquè el progrés no gasti el límit
+        if time.monotonic() - darrera_edicio[0] < 2 or enviats + fallits == total:
+            return
+        darrera_edicio[0] = time.monotonic()
         try:
-            await context.bot.send_message(chat_id=chat_id, text=missatge)
-            enviats += 1
+            await avis.edit_text(f"📢 Enviant missatge d'emergència... {enviats + fallits}/{total}")
         except Exception as e:
-            print(f"❌ No s'ha pogut enviar a {chat_id}: {e}")
-    await update.message.reply_text(f"📢 Missatge d'emergència enviat a {enviats} usuaris.")
+            print(f"⚠️ No s'ha pogut actualitzar el progrés: {e}")
+
+    enviats, fallits, abans = await esdeveniment().difusio.enviar(context.bot, chat_ids, missatge, progres)
+    resum = f"📢 Missatge d'emergència enviat a {enviats + abans} usuaris."
+    if abans:
+        resum += f" ({abans} ja el tenien d'un enviament interromput)"
+    if fallits:
+        resum += f" ❌ {fallits} no l'han pogut rebre."
+    try:
+        await avis.edit_text(resum)
+    except Exception:
+        await update.message.reply_text(resum)
     
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not es_admin(update.message.from_user):
+        await update.message.reply_text("❌ Comanda només per a l'organització.")
+        return
+    await _respondre_pagines(update, _paginar(metriques.resum()))
+
 async def fi30(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global MOSTRAR_FI30
-    MOSTRAR_FI30 = not MOSTRAR_FI30
-    estat = "activat" if MOSTRAR_FI30 else "desactivat"
+    if not es_admin(update.message.from_user):
+        await update.message.reply_text("❌ Comanda només per a l'organització.")
+        return
+    e = esdeveniment()
+    e.mostrar_fi30 = not e.mostrar_fi30
+    estat = "activat" if e.mostrar_fi30 else "desactivat"
     await update.message.reply_text(f"Mostra de l'hora final del bloc 3 {estat}.")
 
+async def resultats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not es_admin(update.message.from_user):
+        await update.message.reply_text("❌ Comanda només per a l'organització.")
+        return
+    index = await index_respostes()
+    if not index.equips:
+        await update.message.reply_text("⚠️ No hi ha punts registrats encara.")
+        return
+    document = exportar_resultats(index).encode("utf-8")
+    await update.message.reply_document(document=document, filename=f"resultats_{esdeveniment().nom}.csv",
+                                        caption=f"🏁 Classificació de {len(index.equips)} equips")
+
+# ----------------------------
+# Revisió de respostes PENDENT
+# ----------------------------
+# Les respostes de proves REVIEW_REQUIRED (o de tipus sense validació
+# automàtica) queden PENDENT. L'organització les llista amb /pendents (de
+# l'índex en memòria, sense llegir la fulla) i les decideix en bloc amb
+# /aprovar i /rebutjar indicant-ne la fila: totes les decisions d'una comanda
+# s'escriuen amb un sol batch_update, l'índex i la classificació s'actualitzen
+# in situ i s'avisa el portaveu de cada equip.
+async def pendents(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not es_admin(update.message.from_user):
+        await update.message.reply_text("❌ Comanda només per a l'organització.")
+        return
+    index = await index_respostes()
+    if not index.pendents:
+        await update.message.reply_text("✅ No hi ha cap resposta pendent de revisar.")
+        return
+    proves = await carregar_proves()
+    ordenades = sorted(index.pendents.items(), key=lambda x: (x[1]["fila"] is None, x[1]["fila"] or 0))
+    linies = [f"⏳ Respostes pendents de revisar ({len(ordenades)}):\n\n"]
+    for (equip, pid), p in ordenades:
+        fila = f"#{p['fila']}" if p["fila"] is not None else "(encara a la cua)"
+        titol = proves.get(pid, {}).get("titol", "")
+        linies.append(f"{fila} {equip} · prova {pid} {titol}\n«{p['resposta']}» {p['hora'] or ''}\n\n")
+    linies.append("Per decidir: /aprovar 12 15:3 … o /rebutjar 13 … (o 'totes').\n"
+                  "Amb fila:punts s'aproven amb una altra puntuació.")
+    await _respondre_pagines(update, _paginar("".join(linies)))
+
+async def aprovar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _decidir_pendents(update, context, "VALIDADA")
+
+async def rebutjar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _decidir_pendents(update, context, "INCORRECTA")
+
+def _seleccionar_pendents(index: IndexRespostes, proves: dict, args: list, estat: str) -> Tuple[list, list]:
+    """Retorna ([(fila, equip, prova_id, punts)], arguments no vàlids)."""
+    per_fila = {p["fila"]: clau for clau, p in index.pendents.items() if p["fila"] is not None}
+    if [a.lower() for a in args] == ["totes"]:
+        args = [str(fila) for fila in sorted(per_fila)]
+    seleccio, errors = [], []
+    for arg in args:
+        fila, _, punts = arg.partition(":")
+        try:
+            clau = per_fila.pop(int(fila))
+            punts = int(punts) if punts else None
+        except (KeyError, ValueError):
+            errors.append(arg)
+            continue
+        equip, pid = clau
+        if estat != "VALIDADA":
+            punts = 0
+        elif punts is None:
+            punts = int(proves[pid]["punts"]) if pid in proves else 0
+        seleccio.append((int(fila), equip, pid, punts))
+    return seleccio, errors
+
+async def _decidir_pendents(update: Update, context: ContextTypes.DEFAULT_TYPE, estat: str):
+    if not es_admin(update.message.from_user):
+        await update.message.reply_text("❌ Comanda només per a l'organització.")
+        return
+    if not context.args:
+        await update.message.reply_text("Format: /aprovar <fila>[:punts] … o /rebutjar <fila> … (les files surten a /pendents)")
+        return
+    index = await index_respostes()
+    proves = await carregar_proves()
+    seleccio, errors = _seleccionar_pendents(index, proves, context.args, estat)
+    if not seleccio:
+        await update.message.reply_text(f"❌ Cap resposta pendent amb aquestes files: {' '.join(errors)}. Mira /pendents")
+        return
+    decisions = [(fila, punts, estat) for fila, _equip, _pid, punts in seleccio]
+    await _en_executor_escriptura(lambda: _magatzem().decidir_records(decisions))
+    for _fila, equip, pid, punts in seleccio:
+        index.decidir(equip, pid, punts, estat)
+        diari.registrar("decisio", equip=equip, prova=pid, punts=punts, estat=estat)
+    # el valor cachejat ja és al dia: una lectura en vol d'abans no el pot trepitjar
+    cache_actualitzat("records")
+
+    verb = "aprovades" if estat == "VALIDADA" else "rebutjades"
+    resum = f"✅ {len(seleccio)} respostes {verb}."
+    if errors:
+        resum += f" ⚠️ Sense resposta pendent: {' '.join(errors)}"
+    await update.message.reply_text(resum)
+
+    equips = await index_equips()
+    usuaris = await index_usuaris()
+    for _fila, equip, pid, punts in seleccio:
+        info = equips.equips.get(equip)
+        chat_id = usuaris.per_username.get(info["portaveu"]) if info else None
+        if chat_id is None:
+            continue
+        if estat == "VALIDADA":
+            avis = f"✅ L'organització ha validat la vostra resposta a la prova {pid}: +{punts} punts."
+        else:
+            avis = f"❌ L'organització ha revisat la vostra resposta a la prova {pid} i no és correcta."
+        await esdeveniment().difusio.enviar_a(context.bot, chat_id, avis)
+
+# ----------------------------
+# Classificació en directe (/seguir)
+# ----------------------------
+# Cada subscriptor té un únic missatge fixat amb la classificació que el bot
+# edita quan canvien les respostes. Les edicions s'agrupen: com a molt una
+# passada cada SEGUIR_INTERVAL segons, cada xat com a molt un cop cada
+# SEGUIR_INTERVAL_XAT segons, i totes passen pel límit global de la difusió.
+class ClassificacioEnDirecte:
+    def __init__(self, path: str, interval: float, interval_xat: float, bucket: TokenBucket):
+        self.path = path
+        self.interval = interval
+        self.interval_xat = interval_xat
+        self.bucket = bucket
+        # chat_id -> {"missatge": message_id, "versio": última versió publicada, "darrera": monotonic}
+        self.seguidors: Dict[int, dict] = {}
+
+    def carregar(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                dades = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ No s'han pogut llegir els seguidors de la classificació: {e}")
+            return
+        for chat_id, message_id in dades.items():
+            self.seguidors[int(chat_id)] = {"missatge": message_id, "versio": None, "darrera": 0.0}
+        if self.seguidors:
+            print(f"📌 {len(self.seguidors)} xats segueixen la classificació")
+
+    async def _desar(self):
+        text = json.dumps({str(c): s["missatge"] for c, s in self.seguidors.items()})
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_WAL_EXECUTOR, _escriure_snapshot, text, self.path)
+
+    async def _text(self) -> Tuple[tuple, str]:
+        index = await index_respostes()
+        versio = (_versio("records"), esdeveniment().mostrar_fi30)
+        if not index.equips:
+            return versio, "⚠️ No hi ha punts registrats encara."
+        pagines = _renderitzat("ranking", "", versio, lambda: _render_ranking(index))
+        # un sol missatge fixat: si no hi cap, en mostrem la primera pàgina
+        return versio, pagines[0] if len(pagines) == 1 else pagines[0].rstrip() + "\n…"
+
+    async def seguir(self, bot, chat_id: int):
+        versio, text = await self._text()
+        await self.bucket.esperar()
+        missatge = await bot.send_message(chat_id=chat_id, text=text)
+        try:
+            await bot.pin_chat_message(chat_id=chat_id, message_id=missatge.message_id, disable_notification=True)
+        except (Forbidden, BadRequest) as e:
+            # sense permís per fixar (p. ex. grups): l'editem igualment
+            print(f"⚠️ No s'ha pogut fixar la classificació a {chat_id}: {e}")
+        self.seguidors[chat_id] = {"missatge": missatge.message_id, "versio": versio, "darrera": time.monotonic()}
+        await self._desar()
+
+    async def deixar(self, bot, chat_id: int) -> bool:
+        seguidor = self.seguidors.pop(chat_id, None)
+        if seguidor is None:
+            return False
+        await self._desar()
+        try:
+            await bot.unpin_chat_message(chat_id=chat_id, message_id=seguidor["missatge"])
+        except (Forbidden, BadRequest):
+            pass
+        return True
+
+    async def _editar(self, bot, chat_id: int, seguidor: dict, versio: tuple, text: str):
+        await self.bucket.esperar()
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=seguidor["missatge"])
+        except RetryAfter as e:
+            # ho tornarem a provar a la propera passada
+            self.bucket.pausar(float(e.retry_after))
+            return
+        except Forbidden:
+            # el bot ha estat bloquejat: deixem de seguir
+            self.seguidors.pop(chat_id, None)
+            await self._desar()
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                # el missatge ja no existeix: en fem un de nou
+                self.seguidors.pop(chat_id, None)
+                try:
+                    await self.seguir(bot, chat_id)
+                except (Forbidden, BadRequest) as e2:
+                    metriques.error("seguiment")
+                    print(f"❌ No s'ha pogut refer la classificació de {chat_id}: {e2}")
+                    await self._desar()
+                return
+        except (TimedOut, NetworkError) as e:
+            metriques.error("seguiment")
+            print(f"⚠️ No s'ha pogut actualitzar la classificació de {chat_id}: {e}")
+            return
+        seguidor["versio"] = versio
+        seguidor["darrera"] = time.monotonic()
+
+    async def publicar(self, bot):
+        """Una passada: edita els missatges que tenen una versió antiga."""
+        if not self.seguidors:
+            return
+        versio, text = await self._text()
+        ara = time.monotonic()
+        pendents = [
+            (chat_id, s) for chat_id, s in list(self.seguidors.items())
+            if s["versio"] != versio and ara - s["darrera"] >= self.interval_xat
+        ]
+        for chat_id, seguidor in pendents:
+            await self._editar(bot, chat_id, seguidor, versio, text)
+
+    async def bucle(self, bot):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.publicar(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metriques.error("seguiment")
+                print(f"⚠️ Error actualitzant la classificació en directe: {e}")
+
+metriques.cua("seguidors_classificacio", lambda: sum(len(e.classificacio.seguidors) for e in _ESDEVENIMENTS.values()))
+
+async def seguir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    classificacio = esdeveniment().classificacio
+    antic = classificacio.seguidors.get(chat_id)
+    await classificacio.seguir(context.bot, chat_id)
+    if antic:
+        try:
+            await context.bot.unpin_chat_message(chat_id=chat_id, message_id=antic["missatge"])
+        except (Forbidden, BadRequest):
+            pass
+    await update.message.reply_text(
+        "📌 Classificació fixada: s'anirà actualitzant sola. Per deixar de seguir-la: /deixar"
+    )
+
+async def deixar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await esdeveniment().classificacio.deixar(context.bot, update.effective_chat.id):
+        await update.message.reply_text("👋 Ja no rebràs actualitzacions de la classificació.")
+    else:
+        await update.message.reply_text("ℹ️ No segueixes la classificació. Per seguir-la: /seguir")
+
+# ----------------------------
+# Esdeveniments (diverses ginkanes en un procés)
+# ----------------------------
+# Tot l'estat d'una ginkana (magatzem, cache, índexs, cua de respostes,
+# seguidors i opcions com mostrar_fi30) viu en un Esdeveniment. El client de
+# Sheets (i la seva quota), els executors, les mètriques i el límit de
+# missatges de Telegram són compartits. L'esdeveniment actiu viatja en una
+# ContextVar: per_esdeveniment() el fixa a cada update segons el xat, i les
+# tasques i crides a l'executor que se'n deriven l'hereten.
+class Esdeveniment:
+    def __init__(self, nom: str, document: str, principal: bool = True):
+        self.nom = nom
+        self.document = document
+        # la primera ginkana fa servir els fitxers de sempre; les altres hi afegeixen el nom
+        fitxer = (lambda path: path) if principal else (lambda path: _fitxer_esdeveniment(path, nom))
+        self.path_sqlite = fitxer(GINKANA_SQLITE)
+        self.path_snapshot = fitxer(SNAPSHOT_PATH)
+        self.magatzem = None
+        self.llest = threading.Event()
+        self.des_de_snapshot = False
+        self.mostrar_fi30 = True   # per defecte mostrem l'hora final del bloc 3
+        self.darrer_us = time.monotonic()
+        # cache i dades derivades
+        self.cache: Dict[str, Tuple[Any, datetime.datetime, int]] = {}
+        self.cache_loaders: Dict[str, Callable[[], Any]] = {}
+        self.cache_carregant: Dict[str, asyncio.Future] = {}
+        self.cache_generacio: Dict[str, int] = {}
+        self.cache_stats: Dict[str, Dict[str, int]] = {}
+        self.versions = {"proves": 0, "equips": 0, "records": 0}
+        self.renders: collections.OrderedDict = collections.OrderedDict()
+        self.matchers: Dict[str, MatcherResposta] = {}
+        self.sync_records = {"llista": None, "reconciliat": 0.0}
+        self.respostes = IndexRespostes()
+        # estat que no es pot tornar a llegir del magatzem: mai s'allibera
+        self.cua = CuaSubmissions(fitxer(SUBMISSIONS_WAL))
+        self.panys_equips: Dict[str, asyncio.Lock] = {}
+        self.difusio = Difusio(fitxer(DIFUSIO_LOG), DIFUSIO_CONCURRENCIA, _BUCKET_TELEGRAM, DIFUSIO_REINTENTS)
+        self.classificacio = ClassificacioEnDirecte(fitxer(SEGUIR_PATH), SEGUIR_INTERVAL,
+                                                    SEGUIR_INTERVAL_XAT, _BUCKET_TELEGRAM)
+
+    def inactiva(self) -> bool:
+        # amb seguidors la classificació es continua publicant: no és inactiva
+        return (time.monotonic() - self.darrer_us >= GINKANA_INACTIVA
+                and not self.classificacio.seguidors and bool(self.cache))
+
+    def alliberar_cache(self):
+        """Buida la cache i el que se'n deriva; es tornarà a llegir al primer ús."""
+        if self.cache_carregant:
+            return
+        for nom in list(self.cache):
+            self.cache_generacio[nom] = self.cache_generacio.get(nom, 0) + 1
+        self.cache.clear()
+        self.renders.clear()
+        self.matchers = {}
+        self.sync_records = {"llista": None, "reconciliat": 0.0}
+        self.respostes = IndexRespostes()
+        print(f"🧹 Cache de la ginkana {self.nom} alliberada per inactivitat")
+
+def _fitxer_esdeveniment(path: str, nom: str) -> str:
+    arrel, extensio = os.path.splitext(path)
+    return f"{arrel}-{nom}{extensio}"
+
+_ESDEVENIMENTS: Dict[str, Esdeveniment] = {}
+_ESDEVENIMENT_ACTUAL: contextvars.ContextVar = contextvars.ContextVar("esdeveniment", default=None)
+# chat_id -> nom de la ginkana triada (els altres xats van a la primera)
+_XATS_ESDEVENIMENT: Dict[int, str] = {}
+
+def configurar_esdeveniments():
+    _ESDEVENIMENTS.clear()
+    parells = [p.split("=", 1) for p in GINKANA_ESDEVENIMENTS.split(",") if "=" in p]
+    if not parells:
+        parells = [("ginkana", GINKANA_PUNTS_SHEET)]
+    for i, (nom, document) in enumerate(parells):
+        nom = nom.strip().lower()
+        _ESDEVENIMENTS[nom] = Esdeveniment(nom, document.strip(), principal=(i == 0))
+    if os.path.exists(GINKANA_XATS):
+        try:
+            with open(GINKANA_XATS, encoding="utf-8") as f:
+                _XATS_ESDEVENIMENT.update({int(c): n for c, n in json.load(f).items() if n in _ESDEVENIMENTS})
+        except (OSError, ValueError) as e:
+            print(f"⚠️ No s'ha pogut llegir {GINKANA_XATS}: {e}")
+
+def esdeveniments() -> list:
+    if not _ESDEVENIMENTS:
+        configurar_esdeveniments()
+    return list(_ESDEVENIMENTS.values())
+
+def esdeveniment() -> Esdeveniment:
+    """Ginkana activa; fora d'un update (scripts, proves), la primera."""
+    e = _ESDEVENIMENT_ACTUAL.get()
+    return e if e is not None else esdeveniments()[0]
+
+def esdeveniment_del_xat(chat_id: Optional[int]) -> Esdeveniment:
+    nom = _XATS_ESDEVENIMENT.get(chat_id)
+    return _ESDEVENIMENTS[nom] if nom in _ESDEVENIMENTS else esdeveniments()[0]
+
+async def triar_esdeveniment(chat_id: int, nom: str) -> Optional[Esdeveniment]:
+    """Associa el xat a la ginkana `nom` i l'activa per a la resta de l'update."""
+    esdeveniments()
+    e = _ESDEVENIMENTS.get(nom.lower())
+    if e is None:
+        return None
+    if _XATS_ESDEVENIMENT.get(chat_id) != e.nom:
+        _XATS_ESDEVENIMENT[chat_id] = e.nom
+        text = json.dumps({str(c): n for c, n in _XATS_ESDEVENIMENT.items()})
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_WAL_EXECUTOR, _escriure_snapshot, text, GINKANA_XATS)
+    _ESDEVENIMENT_ACTUAL.set(e)
+    e.darrer_us = time.monotonic()
+    return e
+
+def per_esdeveniment(handler: Callable[..., Any]):
+    """Executa el handler amb la ginkana del xat com a activa."""
+    @functools.wraps(handler)
+    async def embolcall(update, context):
+        chat = getattr(update, "effective_chat", None)
+        e = esdeveniment_del_xat(chat.id if chat else None)
+        e.darrer_us = time.monotonic()
+        token = _ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            return await handler(update, context)
+        finally:
+            _ESDEVENIMENT_ACTUAL.reset(token)
+    return embolcall
+
+async def ginkana(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        e = await triar_esdeveniment(update.effective_chat.id, context.args[0])
+        if e is None:
+            await update.message.reply_text(f"❌ No hi ha cap ginkana anomenada '{context.args[0]}'.")
+            return
+        await update.message.reply_text(f"✅ Ara jugues a la ginkana '{e.nom}'.")
+        return
+    actual = esdeveniment().nom
+    linies = [f"{'👉' if e.nom == actual else '  '} {e.nom}\n" for e in esdeveniments()]
+    await update.message.reply_text("🗺️ Ginkanes disponibles:\n\n" + "".join(linies) +
+                                    "\nPer canviar-hi: /ginkana <nom>")
+
+# ----------------------------
+# Processament concurrent d'updates
+# ----------------------------
+class ProcessadorPerUsuari(BaseUpdateProcessor):
+    """Processa updates de diferents usuaris en paral·lel i els d'un mateix usuari en ordre.
+
+    L'ordre per usuari manté les converses coherents; la consistència de les
+    respostes d'un equip la garanteixen pany_equip i la clau d'idempotència
+    (chat_id:message_id) de resposta_handler.
+
+    El semàfor de PTB (process_update, que no es pot redefinir) s'agafa abans
+    que el lock de l'usuari: amb el límit allà, els updates en cua d'un sol
+    usuari n'ocuparien totes les places. Per això a PTB li passem un límit
+    ample i el de debò (max_concurrent_updates) s'aplica un cop l'update ja
+    té el torn del seu usuari.
+    """
+
+    # updates acceptats alhora per PTB, la majoria esperant el torn del seu usuari
+    _EN_VOL_MAX = 10000
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max(max_concurrent_updates, self._EN_VOL_MAX))
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._en_cua: Dict[int, int] = {}
+        self._execucions = asyncio.BoundedSemaphore(max_concurrent_updates)
+
+    async def do_process_update(self, update, coroutine):
+        usuari = getattr(update, "effective_user", None)
+        if usuari is None:
+            async with self._execucions:
+                await coroutine
+            return
+        clau = usuari.id
+        lock = self._locks.setdefault(clau, asyncio.Lock())
+        self._en_cua[clau] = self._en_cua.get(clau, 0) + 1
+        try:
+            async with lock, self._execucions:
+                await coroutine
+        finally:
+            self._en_cua[clau] -= 1
+            if not self._en_cua[clau]:
+                # sense més updates d'aquest usuari: alliberem el lock
+                del self._en_cua[clau]
+                del self._locks[clau]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 # ----------------------------
 # Main
 # ----------------------------
-def main():
-    # Inicialitzem worksheets i cache
-    init_worksheets()
-    # Precarreguem proves i equips a l'inici per evitar la primera crida lenta
+async def _precarregar_esdeveniment(app: Application, e: Esdeveniment):
+    # Tornem a encuar les respostes que no s'havien bolcat abans d'aturar-nos
+    e.cua.carregar()
+    e.classificacio.carregar()
+    # les tasques hereten el context: cadascuna treballa sobre la seva ginkana
+    app.bot_data["tasques"] += [
+        asyncio.create_task(e.cua.bucle()),
+        asyncio.create_task(bucle_snapshot()),
+        asyncio.create_task(e.classificacio.bucle(app.bot)),
+    ]
+    # Precarreguem proves i equips a l'inici per evitar la primera crida lenta.
+    # Si venim d'un snapshot no bloqueja: torna les dades desades i refresca en segon pla.
     try:
-        carregar_proves()
-    except Exception as e:
-        print(f"⚠️ Error carregant proves a l'inici: {e}")
+        await carregar_proves()
+    except Exception as ex:
+        print(f"⚠️ Error carregant proves de {e.nom} a l'inici: {ex}")
     try:
-        carregar_equips()
-    except Exception as e:
-        print(f"⚠️ Error carregant equips a l'inici: {e}")
-
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("ajuda", ajuda))
-    app.add_handler(CommandHandler("inscriure", inscriure))
-    app.add_handler(CommandHandler("proves", llistar_proves))
-    app.add_handler(CommandHandler("ranking", ranking))
-    app.add_handler(CommandHandler("ekips", ekips))
-    app.add_handler(CommandHandler("emergencia", emergencia))
-    app.add_handler(CommandHandler("fi30", fi30))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, resposta_handler))
+        await carregar_equips()
+    except Exception as ex:
+        print(f"⚠️ Error carregant equips de {e.nom} a l'inici: {ex}")
+    if e.des_de_snapshot:
+        # la resta de dades del snapshot també es reconcilien ara, no al primer ús
+        for carregar in (index_respostes, index_usuaris, carregar_ajuda, carregar_emergencia):
+            try:
+                await carregar()
+            except Exception as ex:
+                print(f"⚠️ Error reconciliant dades de {e.nom} a l'inici: {ex}")
+
+async def _precarregar(app: Application):
+    app.bot_data["tasques"] = [asyncio.create_task(bucle_refresc_cache()), asyncio.create_task(diari.bucle())]
+    for e in esdeveniments():
+        token = _ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            await _precarregar_esdeveniment(app, e)
+        finally:
+            _ESDEVENIMENT_ACTUAL.reset(token)
+    if METRIQUES_PORT:
+        app.bot_data["servidor_metriques"] = await asyncio.start_server(
+            _servir_metriques, "0.0.0.0", int(METRIQUES_PORT))
+        print(f"📊 Mètriques Prometheus al port {METRIQUES_PORT}")
+
+async def _aturar(app: Application):
+    servidor = app.bot_data.pop("servidor_metriques", None)
+    if servidor:
+        servidor.close()
+    for tasca in app.bot_data.pop("tasques", []):
+        tasca.cancel()
+    await esperar_escriptures_en_segon_pla()
+    for e in esdeveniments():
+        token = _ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            try:
+                await desar_snapshot()
+            except Exception as ex:
+                print(f"⚠️ No s'ha pogut desar el snapshot de {e.nom}: {ex}")
+            # Últim intent de bolcar; el que quedi es recuperarà del WAL en arrencar
+            try:
+                while await e.cua.bolcar():
+                    pass
+            except Exception as ex:
+                print(f"⚠️ Queden {len(e.cua.pendents)} respostes de {e.nom} al WAL: {ex}")
+        finally:
+            _ESDEVENIMENT_ACTUAL.reset(token)
+    try:
+        await diari.bolcar()
+    except Exception as ex:
+        print(f"⚠️ No s'ha pogut escriure el final del diari: {ex}")
+
+# Comanda -> (nom de la mètrica, handler). main() les registra i replay_ginkana.py
+# les reprodueix a partir d'aquesta mateixa taula.
+COMANDES = {
+    "start": ("start", start),
+    "ginkana": ("ginkana", ginkana),
+    "ajuda": ("ajuda", ajuda),
+    "inscriure": ("inscriure", inscriure),
+    "proves": ("llistar_proves", llistar_proves),
+    "ranking": ("ranking", ranking),
+    "ekips": ("ekips", ekips),
+    "seguir": ("seguir", seguir),
+    "deixar": ("deixar", deixar),
+    "emergencia": ("emergencia", emergencia),
+    "fi30": ("fi30", fi30),
+    "stats": ("stats", stats),
+    "resultats": ("resultats", resultats),
+    "pendents": ("pendents", pendents),
+    "aprovar": ("aprovar", aprovar),
+    "rebutjar": ("rebutjar", rebutjar),
+}
+
+def main():
+    if not TELEGRAM_TOKEN:
+        print("❌ Falta la variable d'entorn TELEGRAM_TOKEN")
+        exit(1)
+    # Amb snapshot arrenquem de seguida i obrim el magatzem (worksheets o
+    # SQLite) en segon pla; sense, l'obrim abans de començar com sempre.
+    for e in esdeveniments():
+        token = _ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            e.des_de_snapshot = carregar_snapshot()
+        finally:
+            _ESDEVENIMENT_ACTUAL.reset(token)
+        if e.des_de_snapshot:
+            threading.Thread(target=_init_magatzem_en_fons, args=(e,), name=f"init-magatzem-{e.nom}", daemon=True).start()
+        else:
+            init_magatzem(e)
+
+    builder = Application.builder().token(TELEGRAM_TOKEN).post_init(_precarregar).post_shutdown(_aturar)
+    if UPDATES_CONCURRENTS:
+        builder = builder.concurrent_updates(ProcessadorPerUsuari(UPDATES_CONCURRENCY))
+    app = builder.build()
+    if DIARI_PATH:
+        app.add_handler(TypeHandler(Update, registrar_update), group=-1)
+    for comanda, (nom, handler) in COMANDES.items():
+        app.add_handler(CommandHandler(comanda, mesurat(nom, per_esdeveniment(handler))))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, mesurat("resposta_handler", per_esdeveniment(resposta_handler))))
     app.add_handler(MessageHandler(filters.COMMAND, lambda u,c: u.message.reply_text("Comanda desconeguda")))
-    print("✅ Bot Ginkana en marxa...")
-    app.run_polling()
+    if WEBHOOK_URL:
+        print(f"✅ Bot Ginkana en marxa (webhook al port {PORT})...")
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            # per defecte, un secret derivat del token perquè ningú més ens pugui enviar updates
+            secret_token=WEBHOOK_SECRET or hashlib.sha256(TELEGRAM_TOKEN.encode()).hexdigest(),
+        )
+    else:
+        print("✅ Bot Ginkana en marxa...")
+        app.run_polling()
 
 if __name__=="__main__":
     main()
@@ -0,0 +1,300 @@
+"""
+Banc de proves de càrrega sense xarxa per al bot de la Ginkana.
+
+Executa els handlers reals (inscriure, resposta_handler, ranking,
+llistar_proves, emergencia) amb Update/Context sintètics contra un Google
+Sheets fals en memòria que afegeix latència i errors de quota configurables.
+Les proves surten de proves_ginkana.csv.
+
+Exemples:
+    python bench_ginkana.py --equips 100
+    python bench_ginkana.py --equips 100 --latencia 400 --error-quota 0.05 --sortida base.json
+    python bench_ginkana.py --equips 100 --comparar base.json
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+
+# El bot llegeix la configuració en importar-se: fitxers d'estat en un directori temporal
+_DIR_ESTAT = tempfile.mkdtemp(prefix="bench_ginkana_")
+os.environ.setdefault("SUBMISSIONS_WAL", os.path.join(_DIR_ESTAT, "submissions.wal"))
+os.environ.setdefault("DIFUSIO_LOG", os.path.join(_DIR_ESTAT, "difusions.log"))
+os.environ.setdefault("DIARI_PATH", os.path.join(_DIR_ESTAT, "diari.jsonl"))
+os.environ.setdefault("FLUSH_INTERVAL", "0.5")
+os.environ.setdefault("ADMINS", "organitzacio")
+os.environ["GINKANA_BACKEND"] = "sheets"
+
+import gspread  # noqa: E402
+
+import GinkanaGinestarBot as bot  # noqa: E402
+import eines_ginkana as eines  # noqa: E402
+
+DIR_REPO = os.path.dirname(os.path.abspath(__file__))
+
+# ----------------------------
+# Google Sheets fals
+# ----------------------------
+class _RespostaQuota:
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": "Quota exceeded for quota metric 'Read requests'",
+                          "status": "RESOURCE_EXHAUSTED"}}
+
+class _RespostaGraella:
+    status_code = 400
+
+    def __init__(self, rang, files):
+        self.text = f"Range ({rang}) exceeds grid limits. Max rows: {files}"
+
+    def json(self):
+        return {"error": {"code": 400, "message": self.text, "status": "INVALID_ARGUMENT"}}
+
+class Comptadors:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.crides = {}    # (fulla, mètode) -> n
+        self.errors = 0
+
+    def sumar(self, fulla: str, metode: str):
+        with self._lock:
+            self.crides[(fulla, metode)] = self.crides.get((fulla, metode), 0) + 1
+
+    def lectures(self) -> int:
+        return sum(n for (_, m), n in self.crides.items() if m in FullaFalsa.LECTURES)
+
+    def escriptures(self) -> int:
+        return sum(n for (_, m), n in self.crides.items() if m not in FullaFalsa.LECTURES)
+
+class FullaFalsa:
+    """Imita els mètodes de gspread.Worksheet que fa servir el bot."""
+
+    LECTURES = {"get_all_records", "acell", "get", "row_values"}
+
+    def __init__(self, nom, capcalera, files, opcions, comptadors):
+        self.nom = nom
+        self.capcalera = capcalera
+        self.files = [list(f) for f in files]
+        self.opcions = opcions
+        self.comptadors = comptadors
+        self.text_a1 = ""
+        self._lock = threading.Lock()
+
+    def _crida(self, metode):
+        self.comptadors.sumar(self.nom, metode)
+        latencia = self.opcions.latencia / 1000
+        time.sleep(max(0.0, random.gauss(latencia, latencia * self.opcions.jitter)))
+        if random.random() < self.opcions.error_quota:
+            self.comptadors.errors += 1
+            raise gspread.exceptions.APIError(_RespostaQuota())
+
+    def get_all_records(self):
+        self._crida("get_all_records")
+        with self._lock:
+            return [dict(zip(self.capcalera, gspread.utils.numericise_all([str(v) for v in f])))
+                    for f in self.files]
+
+    def get(self, rang):
+        self._crida("get")
+        inici = int("".join(c for c in rang.split(":")[0] if c.isdigit())) - 2
+        with self._lock:
+            # com Sheets: els append deixen la graella just amb les files escrites
+            # i un rang que comença més avall és un error, no una llista buida
+            if inici >= len(self.files):
+                raise gspread.exceptions.APIError(_RespostaGraella(f"'{self.nom}'!{rang}", len(self.files) + 1))
+            return [[str(v) for v in f] for f in self.files[inici:]]
+
+    def row_values(self, fila):
+        self._crida("row_values")
+        return list(self.capcalera)
+
+    def acell(self, cella):
+        self._crida("acell")
+        return types.SimpleNamespace(value=self.text_a1)
+
+    def append_row(self, fila, **kwargs):
+        self._crida("append_row")
+        with self._lock:
+            # com Sheets amb RAW (el valor per defecte de gspread): es desa el que arriba, tal qual
+            self.files.append(list(fila))
+
+    def append_rows(self, files, **kwargs):
+        self._crida("append_rows")
+        with self._lock:
+            self.files.extend(list(f) for f in files)
+
+class DocumentFals:
+    def __init__(self, fulles):
+        self.fulles = fulles
+
+    def worksheet(self, nom):
+        return self.fulles[nom]
+
+class ClientFals:
+    def __init__(self, document):
+        self.document = document
+
+    def open(self, nom):
+        return self.document
+
+def _llegir_proves():
+    with open(os.path.join(DIR_REPO, "proves_ginkana.csv"), encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+def crear_document(opcions, comptadors, proves):
+    capcaleres = bot._CAPCALERES
+    fulles = {
+        "proves": FullaFalsa("proves", capcaleres["proves"],
+                             [[p.get(c, "") for c in capcaleres["proves"]] for p in proves], opcions, comptadors),
+        "equips": FullaFalsa("equips", capcaleres["equips"], [], opcions, comptadors),
+        "punts_equips": FullaFalsa("punts_equips", capcaleres["punts_equips"], [], opcions, comptadors),
+        "usuaris": FullaFalsa("usuaris", capcaleres["usuaris"], [], opcions, comptadors),
+        "ajuda": FullaFalsa("ajuda", [], [], opcions, comptadors),
+        "emergencia": FullaFalsa("emergencia", [], [], opcions, comptadors),
+    }
+    fulles["ajuda"].text_a1 = "Ajuda del banc de proves"
+    fulles["emergencia"].text_a1 = "⚠️ Missatge d'emergència del banc de proves"
+    return DocumentFals(fulles)
+
+# ----------------------------
+# Telegram fals
+# ----------------------------
+_ID_MISSATGE = [0]
+
+def update_fals(text, usuari, opcions):
+    _ID_MISSATGE[0] += 1
+    chat = types.SimpleNamespace(id=usuari.id, type="private")
+    return eines.update_fals(text, usuari, chat, _ID_MISSATGE[0], _ID_MISSATGE[0],
+                             opcions.latencia_telegram / 1000)
+
+# ----------------------------
+# Escenari
+# ----------------------------
+async def _executar(mesures, nom, handler, update, context):
+    inici = time.perf_counter()
+    error = False
+    try:
+        await handler(update, context)
+    except Exception:
+        error = True
+    mesures.afegir(nom, time.perf_counter() - inici, error)
+
+async def _equip(i, opcions, proves, bot_fals, mesures):
+    usuari = types.SimpleNamespace(id=100000 + i, username=f"portaveu{i}", first_name=f"Portaveu{i}",
+                                   is_bot=False)
+    nom = f"Equip{i:03d}"
+    await _executar(mesures, "inscriure", bot.inscriure,
+                    update_fals(f"/inscriure {nom} a,b,c", usuari, opcions),
+                    eines.context_fals(bot_fals, [nom, "a,b,c"]))
+    for prova in proves:
+        correctes = str(prova["resposta"]).split("|")
+        resposta = random.choice(correctes) if random.random() < opcions.encerts else "no ho sé"
+        await _executar(mesures, "resposta_handler", bot.resposta_handler,
+                        update_fals(f"resposta {prova['id']} {resposta}", usuari, opcions),
+                        eines.context_fals(bot_fals))
+        sorteig = random.random()
+        if sorteig < opcions.ranking:
+            await _executar(mesures, "ranking", bot.ranking,
+                            update_fals("/ranking", usuari, opcions), eines.context_fals(bot_fals))
+        elif sorteig < opcions.ranking + opcions.llistar:
+            await _executar(mesures, "llistar_proves", bot.llistar_proves,
+                            update_fals("/proves", usuari, opcions), eines.context_fals(bot_fals))
+        await asyncio.sleep(random.uniform(0, opcions.pausa / 1000))
+
+async def escenari(opcions):
+    random.seed(opcions.llavor)
+    comptadors = Comptadors()
+    proves = _llegir_proves()
+    bot.SHEETS_LECTURES_MINUT = opcions.quota_lectures
+    bot.SHEETS_ESCRIPTURES_MINUT = opcions.quota_escriptures
+    bot.gc = ClientFals(crear_document(opcions, comptadors, proves))
+    bot.init_magatzem()
+    bot_fals = eines.BotFals(opcions.latencia_telegram / 1000)
+    mesures = eines.Mesures()
+
+    tasques_fons = [asyncio.create_task(bot.esdeveniment().cua.bucle()),
+                    asyncio.create_task(bot.bucle_refresc_cache())]
+    inici = time.perf_counter()
+    await asyncio.gather(*(_equip(i, opcions, proves, bot_fals, mesures) for i in range(opcions.equips)))
+    admin = types.SimpleNamespace(id=1, username="organitzacio", first_name="Organització", is_bot=False)
+    await _executar(mesures, "emergencia", bot.emergencia,
+                    update_fals("/emergencia", admin, opcions), eines.context_fals(bot_fals))
+    durada = time.perf_counter() - inici
+
+    for tasca in tasques_fons:
+        tasca.cancel()
+    await bot.esperar_escriptures_en_segon_pla()
+    # buidem la cua perquè les escriptures comptin igual en totes les execucions
+    try:
+        while await bot.esdeveniment().cua.bolcar():
+            pass
+    except Exception:
+        pass
+    return mesures, comptadors, durada, bot_fals
+
+def resum(mesures, comptadors, durada, bot_fals):
+    operacions = mesures.operacions()
+    return eines.resum(
+        mesures, durada, bot_fals.enviats,
+        lectures_sheets=comptadors.lectures(),
+        escriptures_sheets=comptadors.escriptures(),
+        errors_quota_injectats=comptadors.errors,
+        lectures_per_operacio=round(comptadors.lectures() / operacions, 3) if operacions else 0.0,
+        escriptures_per_operacio=round(comptadors.escriptures() / operacions, 3) if operacions else 0.0,
+        crides_sheets={f"{f}.{m}": n for (f, m), n in sorted(comptadors.crides.items())},
+    )
+
+def imprimir(resultat, base=None):
+    base = base or {}
+    eines.imprimir_capcalera(resultat, base)
+    print(f"Sheets: {resultat['lectures_sheets']} lectures"
+          f"{eines.delta(resultat['lectures_sheets'], base.get('lectures_sheets'))}, "
+          f"{resultat['escriptures_sheets']} escriptures"
+          f"{eines.delta(resultat['escriptures_sheets'], base.get('escriptures_sheets'))}, "
+          f"{resultat['errors_quota_injectats']} errors de quota injectats")
+    print(f"Per operació: {resultat['lectures_per_operacio']} lectures, "
+          f"{resultat['escriptures_per_operacio']} escriptures")
+    eines.imprimir_handlers(resultat, base)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de proves de càrrega del bot de la Ginkana")
+    parser.add_argument("--equips", type=int, default=100, help="equips que responen alhora")
+    parser.add_argument("--latencia", type=float, default=300, help="latència mitjana de Sheets (ms)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="desviació relativa de la latència")
+    parser.add_argument("--error-quota", type=float, default=0.0, help="probabilitat d'error 429 per crida")
+    parser.add_argument("--quota-lectures", type=int, default=0,
+                        help="lectures de Sheets per minut (0 = sense límit, el bot en fa servir 60)")
+    parser.add_argument("--quota-escriptures", type=int, default=0,
+                        help="escriptures de Sheets per minut (0 = sense límit, el bot en fa servir 60)")
+    parser.add_argument("--latencia-telegram", type=float, default=30, help="latència de Telegram (ms)")
+    parser.add_argument("--encerts", type=float, default=0.8, help="fracció de respostes correctes")
+    parser.add_argument("--ranking", type=float, default=0.2, help="probabilitat de /ranking després de respondre")
+    parser.add_argument("--llistar", type=float, default=0.1, help="probabilitat de /proves després de respondre")
+    parser.add_argument("--pausa", type=float, default=200, help="pausa màxima entre missatges d'un equip (ms)")
+    parser.add_argument("--llavor", type=int, default=1975)
+    parser.add_argument("--sortida", help="desa els resultats en JSON (per fer-los servir de base)")
+    parser.add_argument("--comparar", help="JSON d'una execució anterior amb què comparar")
+    opcions = parser.parse_args(argv)
+
+    resultat = resum(*asyncio.run(escenari(opcions)))
+    base = None
+    if opcions.comparar:
+        with open(opcions.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+    imprimir(resultat, base)
+    if opcions.sortida:
+        with open(opcions.sortida, "w", encoding="utf-8") as f:
+            json.dump(resultat, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Peces compartides pel banc de proves (bench_ginkana.py) i el replay del diari
+(replay_ginkana.py): un Telegram fals amb latència configurable, la recollida de
+latències per handler i el resum en JSON i per pantalla.
+
+No importa el bot: els scripts el configuren amb variables d'entorn abans d'importar-lo.
+"""
+import asyncio
+import statistics
+import types
+
+# ----------------------------
+# Telegram fals
+# ----------------------------
+class MissatgeEnviat:
+    _seguent = 1
+
+    def __init__(self, chat_id, latencia):
+        self.chat_id = chat_id
+        self.message_id = MissatgeEnviat._seguent
+        MissatgeEnviat._seguent += 1
+        self.latencia = latencia
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(self.latencia)
+        return self
+
+class MissatgeFals:
+    def __init__(self, text, usuari, chat, message_id, latencia):
+        self.text = text
+        self.from_user = usuari
+        self.message_id = message_id
+        self.chat = chat
+        self.chat_id = chat.id
+        self.latencia = latencia
+        self.respostes = []
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(self.latencia)
+        self.respostes.append(text)
+        return MissatgeEnviat(self.chat_id, self.latencia)
+
+    async def reply_document(self, document, **kwargs):
+        await asyncio.sleep(self.latencia)
+        return MissatgeEnviat(self.chat_id, self.latencia)
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+class BotFals:
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.enviats = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latencia)
+        self.enviats += 1
+        return MissatgeEnviat(chat_id, self.latencia)
+
+    def __getattr__(self, nom):
+        # pin_chat_message, edit_message_text…: només la latència
+        async def crida(*args, **kwargs):
+            await asyncio.sleep(self.latencia)
+            return True
+        return crida
+
+def update_fals(text, usuari, chat, message_id, update_id, latencia):
+    missatge = MissatgeFals(text, usuari, chat, message_id, latencia)
+    return types.SimpleNamespace(message=missatge, effective_message=missatge, effective_user=usuari,
+                                 effective_chat=chat, update_id=update_id)
+
+def context_fals(bot_fals, args=None):
+    return types.SimpleNamespace(args=list(args or []), bot=bot_fals, bot_data={}, application=None)
+
+# ----------------------------
+# Mesures i resum
+# ----------------------------
+class Mesures:
+    def __init__(self):
+        self.latencies = {}   # handler -> [segons]
+        self.errors = {}
+
+    def afegir(self, handler, segons, error=False):
+        self.latencies.setdefault(handler, []).append(segons)
+        if error:
+            self.errors[handler] = self.errors.get(handler, 0) + 1
+
+    def operacions(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+def percentil(valors, p):
+    ordenats = sorted(valors)
+    k = (len(ordenats) - 1) * p / 100
+    baix, alt = int(k), min(int(k) + 1, len(ordenats) - 1)
+    return ordenats[baix] + (ordenats[alt] - ordenats[baix]) * (k - baix)
+
+def resum(mesures: Mesures, durada: float, enviats: int, **extra) -> dict:
+    """Durada, throughput i percentils per handler; `extra` s'hi afegeix tal qual."""
+    operacions = mesures.operacions()
+    resultat = {
+        "durada_s": round(durada, 3),
+        "operacions": operacions,
+        "throughput_ops_s": round(operacions / durada, 1) if durada else 0.0,
+        **extra,
+        "missatges_difosos": enviats,
+        "handlers": {},
+    }
+    for nom, valors in sorted(mesures.latencies.items()):
+        resultat["handlers"][nom] = {
+            "n": len(valors),
+            "errors": mesures.errors.get(nom, 0),
+            "p50_ms": round(percentil(valors, 50) * 1000, 2),
+            "p95_ms": round(percentil(valors, 95) * 1000, 2),
+            "p99_ms": round(percentil(valors, 99) * 1000, 2),
+            "mitjana_ms": round(statistics.mean(valors) * 1000, 2),
+        }
+    return resultat
+
+def delta(valor, anterior) -> str:
+    if anterior in (None, 0):
+        return ""
+    return f" ({(valor - anterior) / anterior * 100:+.0f}%)"
+
+def imprimir_capcalera(resultat: dict, base: dict = None):
+    base = base or {}
+    print(f"Durada: {resultat['durada_s']} s{delta(resultat['durada_s'], base.get('durada_s'))}")
+    print(f"Operacions: {resultat['operacions']}  "
+          f"throughput: {resultat['throughput_ops_s']} ops/s"
+          f"{delta(resultat['throughput_ops_s'], base.get('throughput_ops_s'))}")
+
+def imprimir_handlers(resultat: dict, base: dict = None):
+    base = base or {}
+    print()
+    print(f"{'handler':<18}{'n':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for nom, h in resultat["handlers"].items():
+        anterior = base.get("handlers", {}).get(nom, {})
+        print(f"{nom:<18}{h['n']:>6}{h['errors']:>8}{h['p50_ms']:>10}{h['p95_ms']:>10}{h['p99_ms']:>10}"
+              f"{delta(h['p95_ms'], anterior.get('p95_ms'))}")
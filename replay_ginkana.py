@@ -0,0 +1,278 @@
+"""
+Reprodueix el diari del bot de la Ginkana (DIARI_PATH) contra un magatzem SQLite local.
+
+Modes:
+    updates  torna a passar cada update pels handlers reals amb un Telegram fals,
+             amb el ritme original o accelerat: una jornada real com a prova de
+             càrrega reproduïble. Al final compara l'estat obtingut amb el del diari.
+    estat    aplica directament els canvis d'estat registrats (inscripcions, usuaris,
+             respostes i decisions) per reconstruir les dades després d'un incident
+             amb Sheets.
+
+Els fitxers rotats (diari.jsonl.N … diari.jsonl.1) s'hi afegeixen sols, del més antic
+al més nou. Les proves surten dels CSV de --llavor, com en arrencar amb SQLite. Les
+comandes d'organització (/aprovar, /emergencia…) només es reprodueixen si ADMINS
+inclou els mateixos usuaris que el dia de la ginkana.
+
+Exemples:
+    python replay_ginkana.py diari_ginkana.jsonl --mode estat --sqlite recuperat.sqlite3 --resultats final.csv
+    python replay_ginkana.py diari_ginkana.jsonl --ritme 1
+    python replay_ginkana.py diari_ginkana.jsonl --ritme 20 --latencia-telegram 30 --sortida dissabte.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+import eines_ginkana as eines
+
+DIR_REPO = os.path.dirname(os.path.abspath(__file__))
+
+bot = None   # el mòdul del bot: s'importa quan ja sabem quines ginkanes hi ha al diari
+
+# ----------------------------
+# Lectura del diari
+# ----------------------------
+def fitxers_diari(path: str) -> list:
+    """El fitxer i els seus rotats, del més antic al més nou."""
+    rotats = []
+    while os.path.exists(f"{path}.{len(rotats) + 1}"):
+        rotats.append(f"{path}.{len(rotats) + 1}")
+    return rotats[::-1] + ([path] if os.path.exists(path) else [])
+
+def llegir_diari(paths: list, ginkana: str = None) -> list:
+    entrades = []
+    for base in paths:
+        fitxers = fitxers_diari(base)
+        if not fitxers:
+            raise SystemExit(f"❌ No existeix el diari {base}")
+        for fitxer in fitxers:
+            with open(fitxer, encoding="utf-8") as f:
+                for linia in f:
+                    try:
+                        entrada = json.loads(linia)
+                    except ValueError:
+                        # última línia tallada per una caiguda
+                        continue
+                    if ginkana is None or entrada.get("ginkana") == ginkana:
+                        entrades.append(entrada)
+    return entrades
+
+def preparar_entorn(entrades: list, opcions):
+    """Configura el bot (llegeix l'entorn en importar-se) i l'importa."""
+    global bot
+    dir_estat = tempfile.mkdtemp(prefix="replay_ginkana_")
+    noms = list(dict.fromkeys(e["ginkana"] for e in entrades)) or ["ginkana"]
+    os.environ["GINKANA_ESDEVENIMENTS"] = ",".join(f"{nom}={nom}" for nom in noms)
+    os.environ["GINKANA_BACKEND"] = "sqlite"
+    os.environ["GINKANA_MIRALL_SHEETS"] = "0"
+    os.environ["GINKANA_SQLITE"] = opcions.sqlite or os.path.join(dir_estat, "ginkana.sqlite3")
+    os.environ["GINKANA_DIR_LLAVOR"] = opcions.llavor
+    # la resta de fitxers d'estat, lluny dels de producció
+    for variable, fitxer in (("SUBMISSIONS_WAL", "submissions.wal"), ("DIFUSIO_LOG", "difusions.log"),
+                             ("SEGUIR_PATH", "seguidors.json"), ("SNAPSHOT_PATH", "snapshot.json"),
+                             ("GINKANA_XATS", "xats_ginkanes.json")):
+        os.environ[variable] = os.path.join(dir_estat, fitxer)
+    os.environ["DIARI_PATH"] = ""
+    os.environ.setdefault("FLUSH_INTERVAL", "0.5")
+    import GinkanaGinestarBot
+    bot = GinkanaGinestarBot
+    for e in bot.esdeveniments():
+        if os.path.exists(e.path_sqlite):
+            raise SystemExit(f"❌ {e.path_sqlite} ja existeix: el replay necessita un magatzem nou")
+        bot.init_magatzem(e)
+
+# ----------------------------
+# Mode estat
+# ----------------------------
+def reconstruir_estat(entrades: list) -> dict:
+    comptes = {}
+    files = {}   # (ginkana, equip, prova) -> fila de la resposta al magatzem
+    for entrada in entrades:
+        tipus = entrada["tipus"]
+        if tipus == "update":
+            continue
+        magatzem = bot._ESDEVENIMENTS[entrada["ginkana"]].magatzem
+        if tipus == "equip":
+            magatzem.afegir_equip([entrada["equip"], entrada["portaveu"], entrada["jugadors"], entrada["hora"]])
+        elif tipus == "usuari":
+            magatzem.afegir_usuari([entrada["username"], entrada["chat"]])
+        elif tipus == "resposta":
+            row = [entrada["equip"], entrada["prova"], entrada["resposta"], entrada["punts"],
+                   entrada["estat"], entrada["hora"]]
+            fila = magatzem.afegir_records([row])[0]
+            files[(entrada["ginkana"], entrada["equip"], str(entrada["prova"]))] = fila
+        elif tipus == "decisio":
+            fila = files.get((entrada["ginkana"], entrada["equip"], str(entrada["prova"])))
+            if fila is None:
+                print(f"⚠️ Decisió sobre una resposta que no és al diari: {entrada['equip']} prova {entrada['prova']}")
+                continue
+            magatzem.decidir_records([(fila, entrada["punts"], entrada["estat"])])
+        comptes[tipus] = comptes.get(tipus, 0) + 1
+    return comptes
+
+# ----------------------------
+# Mode updates
+# ----------------------------
+def update_de(entrada: dict, latencia: float):
+    usuari = types.SimpleNamespace(id=entrada["usuari"], username=entrada.get("username"),
+                                   first_name=entrada.get("nom"), is_bot=False)
+    chat = types.SimpleNamespace(id=entrada["xat"], type="private" if entrada["xat"] == entrada["usuari"] else "group")
+    # mateix message_id que l'original: les claus d'idempotència coincideixen
+    return eines.update_fals(entrada["text"], usuari, chat, entrada["msg"], entrada["update_id"], latencia)
+
+def _handler_de(text: str):
+    if not text.startswith("/"):
+        return "resposta_handler", bot.resposta_handler, []
+    parts = text.split()
+    comanda = parts[0][1:].split("@")[0].lower()
+    if comanda not in bot.COMANDES:
+        return None, None, []
+    nom, handler = bot.COMANDES[comanda]
+    return nom, handler, parts[1:]
+
+async def _executar(mesures: eines.Mesures, nom: str, handler, entrada: dict, update, context):
+    # la ginkana del xat en aquell moment, encara que el diari no comenci amb el seu /ginkana
+    bot._XATS_ESDEVENIMENT[entrada["xat"]] = entrada["ginkana"]
+    inici = time.perf_counter()
+    error = False
+    try:
+        await bot.per_esdeveniment(handler)(update, context)
+    except Exception as e:
+        error = True
+        print(f"⚠️ Error reproduint l'update {entrada['update_id']} ({nom}): {e}")
+    mesures.afegir(nom, time.perf_counter() - inici, error)
+
+async def reproduir_updates(entrades: list, opcions):
+    updates = [e for e in entrades if e["tipus"] == "update" and e.get("text") and e.get("xat") is not None]
+    latencia = opcions.latencia_telegram / 1000
+    bot_fals = eines.BotFals(latencia)
+    # el mateix model de concurrència que en producció: en paral·lel, però en ordre per usuari
+    processador = bot.ProcessadorPerUsuari(opcions.concurrencia)
+    mesures = eines.Mesures()
+
+    tasques_fons = [asyncio.create_task(bot.bucle_refresc_cache())]
+    for e in bot.esdeveniments():
+        token = bot._ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            tasques_fons.append(asyncio.create_task(e.cua.bucle()))
+        finally:
+            bot._ESDEVENIMENT_ACTUAL.reset(token)
+
+    en_curs = set()
+    inici = time.perf_counter()
+    t0 = updates[0]["t"] if updates else 0
+    for entrada in updates:
+        if opcions.ritme > 0:
+            espera = (entrada["t"] - t0) / opcions.ritme - (time.perf_counter() - inici)
+            if espera > 0:
+                await asyncio.sleep(espera)
+        nom, handler, args = _handler_de(entrada["text"])
+        if handler is None:
+            continue
+        update = update_de(entrada, latencia)
+        context = eines.context_fals(bot_fals, args)
+        tasca = asyncio.create_task(
+            processador.process_update(update, _executar(mesures, nom, handler, entrada, update, context)))
+        en_curs.add(tasca)
+        tasca.add_done_callback(en_curs.discard)
+    await asyncio.gather(*list(en_curs))
+    durada = time.perf_counter() - inici
+
+    for tasca in tasques_fons:
+        tasca.cancel()
+    await bot.esperar_escriptures_en_segon_pla()
+    for e in bot.esdeveniments():
+        token = bot._ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            while await e.cua.bolcar():
+                pass
+        finally:
+            bot._ESDEVENIMENT_ACTUAL.reset(token)
+    return mesures, durada, bot_fals.enviats
+
+def comparar_estat(entrades: list) -> list:
+    """Diferències entre les respostes del diari i les que han quedat al magatzem."""
+    esperat = {}
+    for entrada in entrades:
+        if entrada["tipus"] in ("resposta", "decisio"):
+            clau = (entrada["ginkana"], entrada["equip"], str(entrada["prova"]))
+            esperat[clau] = (int(entrada["punts"] or 0), entrada["estat"])
+    obtingut = {}
+    for e in bot.esdeveniments():
+        for r in e.magatzem.records():
+            if r.get("equip"):
+                obtingut[(e.nom, r["equip"], str(r["prova_id"]))] = (int(r["punts"] or 0), r["estat"])
+    diferencies = []
+    for clau in sorted(set(esperat) | set(obtingut)):
+        if esperat.get(clau) != obtingut.get(clau):
+            diferencies.append(f"{clau[0]}/{clau[1]} prova {clau[2]}: "
+                               f"diari {esperat.get(clau)}, replay {obtingut.get(clau)}")
+    return diferencies
+
+async def exportar_resultats(path: str):
+    """Classificació final de cada ginkana en CSV (les altres, amb el nom al fitxer)."""
+    for i, e in enumerate(bot.esdeveniments()):
+        token = bot._ESDEVENIMENT_ACTUAL.set(e)
+        try:
+            index = await bot.index_respostes()
+        finally:
+            bot._ESDEVENIMENT_ACTUAL.reset(token)
+        fitxer = path if i == 0 else bot._fitxer_esdeveniment(path, e.nom)
+        with open(fitxer, "w", encoding="utf-8", newline="") as f:
+            f.write(bot.exportar_resultats(index))
+        print(f"🏁 Classificació de {e.nom} ({len(index.equips)} equips) a {fitxer}")
+
+def imprimir(resultat: dict):
+    eines.imprimir_capcalera(resultat)
+    eines.imprimir_handlers(resultat)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprodueix el diari del bot de la Ginkana")
+    parser.add_argument("fitxers", nargs="+", help="diari(s) JSONL; els rotats s'hi afegeixen sols")
+    parser.add_argument("--mode", choices=("updates", "estat"), default="updates")
+    parser.add_argument("--ginkana", help="reprodueix només aquesta ginkana")
+    parser.add_argument("--sqlite", help="magatzem SQLite de sortida (ha de ser nou; per defecte, temporal)")
+    parser.add_argument("--llavor", default=DIR_REPO, help="directori amb proves_ginkana.csv i els textos")
+    parser.add_argument("--ritme", type=float, default=0,
+                        help="velocitat respecte de l'original (1 = temps real, 0 = tan de pressa com es pugui)")
+    parser.add_argument("--concurrencia", type=int, default=16, help="updates processats alhora")
+    parser.add_argument("--latencia-telegram", type=float, default=0, help="latència de Telegram (ms)")
+    parser.add_argument("--sortida", help="desa el resum en JSON")
+    parser.add_argument("--resultats", help="exporta la classificació final en CSV")
+    opcions = parser.parse_args(argv)
+
+    entrades = llegir_diari(opcions.fitxers, opcions.ginkana)
+    preparar_entorn(entrades, opcions)
+    print(f"📜 {len(entrades)} entrades del diari; magatzem a {os.environ['GINKANA_SQLITE']}")
+
+    if opcions.mode == "estat":
+        comptes = reconstruir_estat(entrades)
+        print("✅ Estat reconstruït: " + ", ".join(f"{n} {tipus}" for tipus, n in sorted(comptes.items())))
+        if opcions.resultats:
+            asyncio.run(exportar_resultats(opcions.resultats))
+        return 0
+
+    resultat = eines.resum(*asyncio.run(reproduir_updates(entrades, opcions)))
+    imprimir(resultat)
+    diferencies = comparar_estat(entrades)
+    if diferencies:
+        print(f"\n⚠️ {len(diferencies)} respostes no coincideixen amb el diari:")
+        for linia in diferencies[:20]:
+            print(f"   {linia}")
+    else:
+        print("\n✅ Les respostes reproduïdes coincideixen amb les del diari")
+    resultat["diferencies"] = diferencies
+    if opcions.sortida:
+        with open(opcions.sortida, "w", encoding="utf-8") as f:
+            json.dump(resultat, f, indent=2, ensure_ascii=False)
+    if opcions.resultats:
+        asyncio.run(exportar_resultats(opcions.resultats))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
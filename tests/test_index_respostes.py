@@ -0,0 +1,36 @@
+"""Línia de temps de l'índex de respostes a partir de files com les de la fulla."""
+import os
+import sys
+
+import pytest
+
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_REPO)
+
+import GinkanaGinestarBot as bot  # noqa: E402
+
+@pytest.mark.parametrize("hora, segons", [
+    ("09:47:07", 9 * 3600 + 47 * 60 + 7),
+    ("9:47", 9 * 3600 + 47 * 60),
+    ('="09:47:07"', 9 * 3600 + 47 * 60 + 7),
+    ("'09:47:07", 9 * 3600 + 47 * 60 + 7),
+    ("", None),
+    (None, None),
+    ("09.47", None),
+])
+def test_segons_hora(hora, segons):
+    assert bot._segons_hora(hora) == segons
+
+def test_linia_de_temps_amb_hores_de_files_antigues():
+    # files escrites abans amb la fórmula ="HH:MM:SS" i llegides tal qual
+    records = bot.LlistaRecords(
+        {"equip": "A", "prova_id": p, "resposta": "x", "punts": 1, "estat": "VALIDADA",
+         "hora": f'="10:{p:02d}:00"'}
+        for p in range(1, 31)
+    )
+    index = bot.IndexRespostes()
+    index.reconstruir(records)
+    equip = index.equip("A")
+    assert equip["fi_blocs"] == [36600, 37200, 37800]
+    assert equip["darrera_correcta"] == 37800
+    assert "Fi 30 proves 10:30:00" in bot._render_ranking(index)
@@ -0,0 +1,102 @@
+"""Validació de respostes: normalització i MatcherResposta amb les proves reals."""
+import csv
+import os
+import sys
+
+import pytest
+
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_REPO)
+
+import GinkanaGinestarBot as bot  # noqa: E402
+
+with open(os.path.join(DIR_REPO, "proves_ginkana.csv"), encoding="utf-8", newline="") as f:
+    PROVES = {row["id"]: row for row in csv.DictReader(f)}
+
+@pytest.fixture(autouse=True)
+def configuracio(monkeypatch):
+    # aproximació activada a les trivia (RESPOSTA_DISTANCIA="trivia:1"), sigui quin sigui l'entorn
+    monkeypatch.setattr(bot, "_DISTANCIA_PER_TIPUS", bot._distancies_per_tipus("trivia:1"))
+    monkeypatch.setattr(bot, "RESPOSTA_LONGITUD_APROXIMADA", 5)
+
+def matcher(pid, tipus=None):
+    prova = PROVES[pid]
+    return bot.MatcherResposta(prova["resposta"], tipus or prova["tipus"])
+
+@pytest.mark.parametrize("text, esperat", [
+    ("  Pà ", "pa"),
+    ("MÚSICA", "musica"),
+    ("1 992", "1992"),
+    ("1.992", "1992"),
+    ("8/10/1787", "1787-10-08"),
+    ("08-10-1787", "1787-10-08"),
+    ("1918-9-11", "1918-09-11"),
+    ("3,50", "3.5"),
+    ("F.B.C.", "fbc"),
+    ("Love is love!", "loveislove"),
+    ("?!", "?!"),
+])
+def test_normalitzar_resposta(text, esperat):
+    assert bot.normalitzar_resposta(text) == esperat
+
+@pytest.mark.parametrize("pid, resposta, encaixa", [
+    # accents, majúscules i puntuació
+    ("1", "Pà", True),
+    ("1", "pa.", True),
+    ("13", "FARMÀCIA", True),
+    ("14", "simó sabaté ars", True),
+    ("31", "Gracies!", True),
+    # números
+    ("2", "1 992", True),
+    ("2", "1.992", True),
+    ("2", "1993", False),
+    ("7", "54", True),
+    ("7", "55", False),
+    ("24", "cinc", False),
+    # dates en qualsevol format
+    ("3", "11/09/1918", True),
+    ("3", "11 9 1918", True),
+    ("3", "1918-09-11", True),
+    ("3", "12-09-1918", False),
+    ("28", "25/7/1938", True),
+    # inicials
+    ("23", "F.B.C.", True),
+    ("23", "f b c", True),
+    ("23", "FBD", False),
+    # aproximació (distància 1 a trivia)
+    ("5", "musics", True),
+    ("9", "Montserada Bru", True),
+    ("29", "paulonnia", True),
+    ("29", "paulo", False),
+    # textos curts: mai aproximats
+    ("22", "sal", False),
+    ("1", "pan", False),
+    ("19", "M", False),
+])
+def test_encaixa_proves_reals(pid, resposta, encaixa):
+    assert matcher(pid).encaixa(resposta) is encaixa
+
+@pytest.mark.parametrize("tipus, encaixa", [
+    ("trivia", True),
+    ("qr", False),
+    ("final_joc", False),
+])
+def test_aproximacio_per_tipus(tipus, encaixa):
+    assert matcher("5", tipus).encaixa("musics") is encaixa
+
+def test_aproximacio_desactivada_per_defecte(monkeypatch):
+    monkeypatch.setattr(bot, "_DISTANCIA_PER_TIPUS", bot._distancies_per_tipus(""))
+    assert matcher("5").encaixa("musica")
+    assert not matcher("5").encaixa("musics")
+
+def test_resposta_nomes_puntuacio():
+    m = bot.MatcherResposta("?!", "trivia")
+    assert m.encaixa("?!")
+    assert not m.encaixa("...")
+    assert not m.encaixa("!?!?!")
+    assert not matcher("1").encaixa("...")
+
+def test_validate_answer():
+    assert bot.validate_answer(PROVES["2"], "1 992") == (5, "VALIDADA")
+    assert bot.validate_answer(PROVES["2"], "1993") == (0, "INCORRECTA")
+    assert bot.validate_answer(dict(PROVES["2"], resposta="REVIEW_REQUIRED"), "1992") == (0, "PENDENT")